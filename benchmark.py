@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from classification_engine import classify_dataframe, warm_up_process_pool
+from utilities import classify_activity
+from main import apply_dtype_schema, filter_by_user, process_data, save_to_excel, save_to_csv
+
+
+PROCESS_NAMES = ['chrome.exe', 'msedge.exe', 'WINWORD.EXE', 'EXCEL.EXE', 'OUTLOOK.EXE', 'Teams.exe', 'Code.exe',
+                 'ssms.exe', 'AcroRd32.exe', 'Skype.exe', 'explorer.exe', 'mstsc.exe', 'notepad++.exe']
+TITLE_TERMS = ['Facebook', 'Instagram', 'WhatsApp', 'YouTube', 'Netflix', 'Spotify', 'Shopee', 'Mercado Livre',
+               'Microsoft Word', 'Microsoft Excel', 'Outlook', 'Microsoft Teams', 'Visual Studio Code', 'SQL Server',
+               'Cérebro', 'RM', 'relatório.pdf', 'Caixa de entrada', 'Planilha de custos', 'Reunião', 'Google Meet']
+DOMAINS = ['', 'facebook.com', 'web.whatsapp.com', 'youtube.com', 'github.com', 'docs.google.com',
+           'cerebro.sebrae.com.br', 'intranet.sebrae.com.br', 'shopee.com.br', 'stackoverflow.com']
+
+
+def generate_activity_data(rows, distinct_ratio=0.01, seed=0):
+    """
+    Gera um DataFrame sintético com as colunas de entrada da classificação, em que cerca de
+    'distinct_ratio' das linhas são combinações distintas (o resto se repete, como nos dados reais).
+    """
+    rng = np.random.default_rng(seed)
+    distinct = max(1, int(rows * distinct_ratio))
+    titles = [f"{rng.choice(TITLE_TERMS)} - {rng.choice(TITLE_TERMS)} ({i})" for i in range(distinct)]
+    domains = rng.choice(DOMAINS, size=distinct)
+    base = pd.DataFrame({
+        'ProcessName': rng.choice(PROCESS_NAMES, size=distinct),
+        'WindowTitle': titles,
+        'Domain': domains,
+        'URL_Name': [f"https://{domain}/page/{i}" if domain else '' for i, domain in enumerate(domains)],
+    })
+    return base.iloc[rng.integers(0, distinct, size=rows)].reset_index(drop=True)
+
+
+# Atividades típicas de aplicativos (ramos App de build_query: Domain e URL vazios)
+APP_ACTIVITIES = [
+    ('WINWORD.EXE', '{doc}.docx - Word'),
+    ('EXCEL.EXE', '{doc}.xlsx - Excel'),
+    ('POWERPNT.EXE', '{doc}.pptx - PowerPoint'),
+    ('OUTLOOK.EXE', 'Caixa de entrada - {user}@sebrae.com.br - Outlook'),
+    ('Teams.exe', 'Chat | {doc} | Microsoft Teams'),
+    ('AcroRd32.exe', '{doc}.pdf - Adobe Acrobat Reader'),
+    ('Code.exe', '{doc}.py - Visual Studio Code'),
+    ('ssms.exe', 'SQLQuery{n}.sql - Microsoft SQL Server Management Studio'),
+    ('explorer.exe', 'Documentos'),
+    ('mstsc.exe', 'RM - Conexão de Área de Trabalho Remota'),
+    ('Skype.exe', 'Skype'),
+    ('notepad++.exe', '{doc}.txt - Notepad++'),
+]
+
+# Páginas típicas dos navegadores (ramos Web): (domínio, título da página)
+WEB_ACTIVITIES = [
+    ('web.whatsapp.com', '({n}) WhatsApp'),
+    ('www.facebook.com', '({n}) Facebook'),
+    ('www.instagram.com', 'Instagram'),
+    ('www.linkedin.com', '({n}) Feed | LinkedIn'),
+    ('www.youtube.com', '{doc} - YouTube'),
+    ('open.spotify.com', 'Spotify - Web Player'),
+    ('shopee.com.br', 'Shopee Brasil | {doc}'),
+    ('www.mercadolivre.com.br', '{doc} | Mercado Livre'),
+    ('outlook.office.com', 'Email - {user} - Outlook'),
+    ('docs.google.com', '{doc} - Google Docs'),
+    ('teams.microsoft.com', 'Microsoft Teams'),
+    ('github.com', '{doc} · GitHub'),
+    ('stackoverflow.com', '{doc} - Stack Overflow'),
+    ('cerebro.sebrae.com.br', 'Cérebro - {doc}'),
+    ('intranet.sebrae.com.br', 'Intranet Sebrae - {doc}'),
+    ('www.gov.br', '{doc} — gov.br'),
+]
+BROWSERS = {'chrome.exe': ' - Google Chrome', 'msedge.exe': ' - Microsoft Edge', 'firefox.exe': ' — Mozilla Firefox'}
+DOCUMENT_WORDS = ['Relatório', 'Planilha de custos', 'Orçamento', 'Contrato', 'Reunião', 'Apresentação', 'Atendimento',
+                  'Projeto', 'Edital', 'Consultoria', 'Capacitação', 'Ata', 'Proposta', 'Cronograma']
+
+
+def _activity_pool(size, users, rng):
+    """
+    Gera 'size' combinações distintas de (ProcessName, WindowTitle, Domain, URL_Name), metade de aplicativos e metade
+    de páginas web, com títulos variando pelo nome do documento como nos dados reais.
+    """
+    documents = [f"{rng.choice(DOCUMENT_WORDS)} {year} v{version}"
+                 for year, version in zip(rng.integers(2019, 2025, size), rng.integers(1, 20, size))]
+    processes, titles, domains, urls = [], [], [], []
+    for i in range(size):
+        values = {'doc': documents[i], 'user': users[i % len(users)].split('\\')[-1], 'n': i % 50}
+        if i % 2:
+            process, title = APP_ACTIVITIES[rng.integers(len(APP_ACTIVITIES))]
+            domain, url = '', ''
+        else:
+            domain, title = WEB_ACTIVITIES[rng.integers(len(WEB_ACTIVITIES))]
+            process = list(BROWSERS)[rng.integers(len(BROWSERS))]
+            title += BROWSERS[process]
+            url = f"https://{domain}/{documents[i].lower().replace(' ', '-')}/{i}"
+        processes.append(process)
+        titles.append(title.format(**values))
+        domains.append(domain)
+        urls.append(url)
+    return pd.DataFrame({'ProcessName': processes, 'WindowTitle': titles, 'Domain': domains, 'URL_Name': urls})
+
+
+def generate_query_result(rows, distinct_ratio=0.05, users=200, days=30, zipf_exponent=1.1, seed=0):
+    """
+    Gera um DataFrame sintético com as mesmas colunas (e tipos, via DTYPE_SCHEMA) do resultado de build_query.
+    As atividades vêm de um conjunto de 'distinct_ratio' * rows combinações distintas sorteadas com distribuição
+    de Zipf (poucas janelas muito frequentes e uma cauda longa), espalhadas por 'users' usuários e 'days' dias.
+    """
+    rng = np.random.default_rng(seed)
+    usernames = [f"SEBRAE\\user_{i:04d}" for i in range(users)]
+    machines = [f"DF-{rng.choice(['NB', 'DT', 'VM'])}-{i:04d}" if i % 10 else f"PC{i:04d}" for i in range(users)]
+    addresses = [f"10.0.{i // 250}.{i % 250 + 1}" for i in range(users)]
+    pool = _activity_pool(max(1, int(rows * distinct_ratio)), usernames, rng)
+
+    weights = 1.0 / np.arange(1, len(pool) + 1) ** zipf_exponent
+    activity = rng.permutation(len(pool))[rng.choice(len(pool), size=rows, p=weights / weights.sum())]
+    user = rng.integers(0, users, size=rows)
+    seconds = np.sort(rng.integers(0, days * 86400, size=rows))
+    data = pd.DataFrame({
+        'ComputerId': user + 1,
+        'OrganizationId': 'activtrak.sebrae.com.br',
+        'MachineName': np.asarray(machines, dtype=object)[user],
+        'IpAddress': np.asarray(addresses, dtype=object)[user],
+        'HostName': 'activtrak.sebrae.com.br',
+        'UserName': np.asarray(usernames, dtype=object)[user],
+        'Date': pd.Timestamp('2024-03-01') + pd.to_timedelta(seconds, unit='s'),
+        'ProcessName': pool['ProcessName'].to_numpy()[activity],
+        'Domain': pool['Domain'].to_numpy()[activity],
+        'URL_Name': pool['URL_Name'].to_numpy()[activity],
+        'WindowTitle': pool['WindowTitle'].to_numpy()[activity],
+        'UTCActualSliceId': 1709251200 + seconds,
+        'ActivityTime': rng.integers(1, 600, size=rows),
+        'IsConnect': rng.random(rows) < 0.98,
+    })
+    return apply_dtype_schema(data)
+
+
+def benchmark_classification_workers(rows=1000000, distinct_ratio=0.2, workers_list=(1, 2, 4, 8)):
+    """
+    Mede o tempo de classify_dataframe com diferentes quantidades de processos e imprime o speedup relativo a 1 worker.
+    """
+    data = generate_activity_data(rows, distinct_ratio)
+    results = []
+    for workers in workers_list:
+        # Aquece o pool de processos: uma amostra pequena não chegaria a usá-lo (ver min_rows_per_worker)
+        warm_up_process_pool(workers)
+        classify_dataframe(data.iloc[:1000], workers=workers)
+        start = time.perf_counter()
+        classify_dataframe(data, workers=workers)
+        results.append((workers, time.perf_counter() - start))
+
+    baseline = results[0][1]
+    print(f"Classificação de {rows} linhas ({int(rows * distinct_ratio)} combinações distintas)")
+    print(f"{'workers':>8} {'tempo (s)':>10} {'linhas/s':>12} {'speedup':>8}")
+    for workers, elapsed in results:
+        print(f"{workers:>8} {elapsed:>10.2f} {rows / elapsed:>12.0f} {baseline / elapsed:>7.2f}x")
+    return results
+
+
+PIPELINE_STEPS = ['filter_by_user', 'process_data', 'classify_activity', 'save_to_excel', 'save_to_csv']
+
+
+def _time_step(results, rows, step, rows_in, function):
+    """
+    Executa 'function' medindo o tempo de parede e registra o resultado em 'results'.
+    """
+    start = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - start
+    rows_out = len(output) if isinstance(output, pd.DataFrame) else rows_in
+    results.append({'rows': rows, 'step': step, 'rows_in': rows_in, 'rows_out': rows_out,
+                    'seconds': round(elapsed, 4), 'rows_per_second': round(rows_in / elapsed) if elapsed else None})
+    print(f"{rows:>10} {step:<18} {rows_in:>10} {elapsed:>10.2f} {rows_in / max(elapsed, 1e-9):>12.0f}")
+    return output
+
+
+def benchmark_pipeline(sizes=(10000, 1000000, 10000000), distinct_ratio=0.05, steps=PIPELINE_STEPS, rowwise_limit=1000000):
+    """
+    Mede separadamente cada etapa do pipeline de main.py sobre dados sintéticos (generate_query_result)
+    para cada tamanho em 'sizes'. filter_by_user mantém metade dos usuários; as etapas seguintes usam a saída da anterior.
+    classify_activity (linha a linha) é medida em no máximo 'rowwise_limit' linhas, para não levar horas.
+    Retorna a lista de resultados (uma entrada por tamanho e etapa).
+    """
+    results = []
+    print(f"{'linhas':>10} {'etapa':<18} {'entrada':>10} {'tempo (s)':>10} {'linhas/s':>12}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for rows in sizes:
+            data = generate_query_result(rows, distinct_ratio)
+            usernames = ','.join(f"user_{i:04d}" for i in range(0, 200, 2))
+
+            def run(step, function, rows_in):
+                if step in steps:
+                    return _time_step(results, rows, step, rows_in, function)
+                return function()
+
+            source = data.copy()
+            filtered = run('filter_by_user', lambda: filter_by_user(source, usernames), len(source))
+            source = filtered.copy()
+            processed = run('process_data', lambda: process_data(source), len(source))
+            if 'classify_activity' in steps:
+                sample = filtered.iloc[:rowwise_limit]
+                _time_step(results, rows, 'classify_activity', len(sample), lambda: sample.apply(classify_activity, axis=1))
+            if 'save_to_excel' in steps:
+                _time_step(results, rows, 'save_to_excel', len(processed),
+                           lambda: save_to_excel(processed, os.path.join(output_dir, 'benchmark.xlsx')))
+            if 'save_to_csv' in steps:
+                _time_step(results, rows, 'save_to_csv', len(processed),
+                           lambda: save_to_csv(processed, os.path.join(output_dir, 'benchmark.csv')))
+    return results
+
+
+def write_report(results, path):
+    """
+    Grava os resultados em JSON, com o ambiente em que foram medidos, para comparar versões.
+    """
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"Resultados salvos em {path}")
+
+
+def compare_reports(baseline_path, results, tolerance=0.2):
+    """
+    Compara os resultados com um relatório anterior e retorna as etapas que ficaram mais de 'tolerance' (20%) mais lentas.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = {(entry['rows'], entry['step']): entry for entry in json.load(file)['results']}
+    regressions = []
+    for entry in results:
+        previous = baseline.get((entry['rows'], entry['step']))
+        if previous is None or not previous['seconds']:
+            continue
+        ratio = entry['seconds'] / previous['seconds']
+        print(f"{entry['rows']:>10} {entry['step']:<18} {previous['seconds']:>10.2f} -> {entry['seconds']:>10.2f} ({ratio:.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append({**entry, 'baseline_seconds': previous['seconds'], 'ratio': round(ratio, 2)})
+    if regressions:
+        print(f"{len(regressions)} etapa(s) mais de {tolerance:.0%} mais lenta(s) que {baseline_path}.")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do pipeline de classificação.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    workers_parser = commands.add_parser('workers', help="Classificação com múltiplos processos.")
+    workers_parser.add_argument('--rows', type=int, default=1000000)
+    workers_parser.add_argument('--distinct-ratio', type=float, default=0.2)
+    workers_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+
+    pipeline_parser = commands.add_parser('pipeline', help="Etapas de main.py sobre dados sintéticos no formato de build_query.")
+    pipeline_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    pipeline_parser.add_argument('--distinct-ratio', type=float, default=0.05)
+    pipeline_parser.add_argument('--steps', nargs='+', choices=PIPELINE_STEPS, default=PIPELINE_STEPS)
+    pipeline_parser.add_argument('--rowwise-limit', type=int, default=1000000)
+    pipeline_parser.add_argument('--output', default='benchmark_resultados.json')
+    pipeline_parser.add_argument('--baseline', help="Relatório JSON anterior; sai com código 1 se alguma etapa regredir.")
+    pipeline_parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == 'workers':
+        benchmark_classification_workers(args.rows, args.distinct_ratio, args.workers)
+    else:
+        pipeline_results = benchmark_pipeline(args.sizes, args.distinct_ratio, args.steps, args.rowwise_limit)
+        write_report(pipeline_results, args.output)
+        if args.baseline and compare_reports(args.baseline, pipeline_results, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,529 @@
+import re
+import os
+import sys
+import json
+import hashlib
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+# Campos derivados das colunas do DataFrame, exatamente como classify_activity os enxerga:
+#   title/domain/url    -> normalize_text aplicado uma vez (colunas de NORMALIZED_COLUMNS)
+#   title2/domain2/url2 -> normalize_text aplicado duas vezes (redes sociais e Sebrae renormalizam)
+#   process             -> normalize_process(...)
+#   process_raw         -> str(ProcessName), sem normalização
+SOURCE_COLUMNS = {
+    'title': 'WindowTitle',
+    'domain': 'Domain',
+    'url': 'URL_Name',
+    'process': 'ProcessName',
+}
+
+
+# Tabela declarativa de regras: cada linha associa um padrão literal (pattern) em um campo (field) a uma
+# categoria/subcategoria. Linhas do mesmo 'group' formam uma categoria; as categorias são avaliadas pela menor
+# 'priority' de suas linhas e, dentro da categoria, a primeira subcategoria (em ordem de 'priority') que casar vence.
+# 'trigger' indica se o padrão dispara a categoria; linhas com trigger false só escolhem a subcategoria.
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classification_rules.json')
+RULE_KEYS = ['group', 'priority', 'category', 'subcategory', 'tipo', 'field', 'pattern', 'trigger']
+RULE_FIELDS = ['title', 'domain', 'url', 'title2', 'domain2', 'url2', 'process', 'process_raw']
+
+
+def load_rules(path=RULES_PATH):
+    """
+    Lê e valida a tabela de regras de classificação (JSON com a lista 'rules').
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        rules = json.load(file)['rules']
+    for position, rule in enumerate(rules):
+        missing = [key for key in RULE_KEYS if key not in rule]
+        if missing:
+            raise ValueError(f"Regra {position} de {path} sem os campos {missing}.")
+        if rule['field'] not in RULE_FIELDS:
+            raise ValueError(f"Regra {position} de {path} usa o campo desconhecido '{rule['field']}'.")
+        if rule['subcategory'] is None and not rule['trigger']:
+            raise ValueError(f"Regra {position} de {path} não dispara a categoria nem define subcategoria.")
+    return rules
+
+
+RULES = load_rules()
+
+DEFAULT_CLASSIFICATION = ('Outros', None, 'Outros')
+
+
+def _build_combining_pattern():
+    """
+    Monta uma classe de caracteres com todos os code points combinantes (os mesmos descartados por remove_accents).
+    """
+    ranges = []
+    start = previous = None
+    for code in range(sys.maxunicode + 1):
+        if unicodedata.combining(chr(code)):
+            if previous is not None and code == previous + 1:
+                previous = code
+                continue
+            if start is not None:
+                ranges.append((start, previous))
+            start = previous = code
+    if start is not None:
+        ranges.append((start, previous))
+    parts = [re.escape(chr(a)) if a == b else f'{re.escape(chr(a))}-{re.escape(chr(b))}' for a, b in ranges]
+    return re.compile('[' + ''.join(parts) + ']')
+
+
+_COMBINING_RE = _build_combining_pattern()
+_SPECIAL_RE = re.compile(r'[^\w\s]')
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+
+def _alternation(keywords):
+    """
+    Compila uma lista de palavras-chave literais em uma única expressão regular de alternância.
+    """
+    return re.compile('|'.join(re.escape(keyword) for keyword in sorted(set(keywords), key=len, reverse=True)))
+
+
+def _group_by_field(patterns):
+    """
+    Agrupa pares (campo, palavra-chave) em {campo: regex de alternância}.
+    """
+    grouped = {}
+    for field, keyword in patterns:
+        grouped.setdefault(field, []).append(keyword)
+    return {field: _alternation(keywords) for field, keywords in grouped.items()}
+
+
+def compile_rules(rules=RULES):
+    """
+    Compila a tabela de regras uma única vez: um regex de alternância por campo para o gatilho de cada categoria,
+    um por subcategoria e um pré-filtro global por campo que descarta de imediato as linhas sem nenhuma palavra-chave.
+    """
+    groups = {}
+    for rule in sorted(rules, key=lambda rule: rule['priority']):
+        group = groups.setdefault(rule['group'], {
+            'classification': rule['category'],
+            'tipo': rule['tipo'],
+            'match': [],
+            'subclassifications': [],
+        })
+        if (rule['category'], rule['tipo']) != (group['classification'], group['tipo']):
+            raise ValueError(f"O grupo de regras '{rule['group']}' mistura categorias ou tipos diferentes.")
+        pattern = (rule['field'], rule['pattern'])
+        if rule['trigger']:
+            group['match'].append(pattern)
+        if rule['subcategory'] is not None:
+            subclassifications = group['subclassifications']
+            # Linhas consecutivas da mesma subcategoria são verificadas juntas, sem alterar a precedência
+            if subclassifications and subclassifications[-1][0] == rule['subcategory']:
+                subclassifications[-1][1].append(pattern)
+            else:
+                subclassifications.append((rule['subcategory'], [pattern]))
+
+    compiled = []
+    all_patterns = []
+    for group in groups.values():
+        all_patterns.extend(group['match'])
+        compiled.append({
+            'classification': group['classification'],
+            'tipo': group['tipo'],
+            'match': _group_by_field(group['match']),
+            'subclassifications': [(name, _group_by_field(patterns)) for name, patterns in group['subclassifications']],
+        })
+    return {'categories': compiled, 'prefilter': _group_by_field(all_patterns)}
+
+
+COMPILED_RULES = compile_rules()
+
+
+def _as_text(values):
+    """
+    Converte uma coluna em texto, tratando nulos como string vazia (como classify_activity faz com pd.notna).
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    return values.where(values.notna(), '').astype(str)
+
+
+def normalize_series(values):
+    """
+    Versão vetorizada de normalize_text: NFKD, remoção de acentos e caracteres especiais e minúsculas.
+    """
+    return (values.str.normalize('NFKD')
+                  .str.replace(_COMBINING_RE, '', regex=True)
+                  .str.replace(_SPECIAL_RE, '', regex=True)
+                  .str.lower())
+
+
+def _renormalize(values):
+    """
+    Reaplica a normalização apenas nos valores não ASCII, únicos em que uma segunda passada pode mudar o resultado.
+    """
+    non_ascii = values.str.contains(_NON_ASCII_RE)
+    if not non_ascii.any():
+        return values
+    values = values.copy()
+    values[non_ascii] = normalize_series(values[non_ascii])
+    return values
+
+
+def _normalize_process(values):
+    return values.str.lower().str.replace('.', '', regex=False)
+
+
+# Colunas produzidas pelo estágio de normalização (add_normalized_columns) e lidas pelas regras
+NORMALIZED_COLUMNS = {
+    'title': 'WindowTitleNormalized',
+    'domain': 'DomainNormalized',
+    'url': 'URLNormalized',
+    'process': 'ProcessNormalized',
+}
+
+_NORMALIZERS = {
+    'title': normalize_series,
+    'domain': normalize_series,
+    'url': normalize_series,
+    'process': _normalize_process,
+}
+
+
+def _normalize_shard(args):
+    """
+    Executado nos processos do pool: aplica o normalizador a um lote de textos recebido em Arrow IPC.
+    """
+    normalizer, payload = args
+    values = _from_ipc(payload).column(0).to_pandas()
+    return _to_ipc(pa.table({'value': pa.array(normalizer(values), type=pa.string())}))
+
+
+def normalize_values(values, normalizer, workers=1, min_rows_per_worker=10000):
+    """
+    Aplica 'normalizer' a uma Series de textos; com 'workers' > 1 (e pelo menos 'min_rows_per_worker' valores
+    por processo), divide os valores em lotes contíguos normalizados no pool de processos.
+    """
+    workers = min(workers or 1, len(values) // min_rows_per_worker)
+    if workers <= 1:
+        return normalizer(values)
+    bounds = np.linspace(0, len(values), workers + 1, dtype=np.int64)
+    payloads = [(normalizer, _to_ipc(pa.table({'value': pa.array(values.iloc[start:stop], type=pa.string())})))
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+    shards = [_from_ipc(result).column(0).to_pandas() for result in get_process_pool(workers).map(_normalize_shard, payloads)]
+    return pd.Series(np.concatenate([shard.to_numpy(dtype=object) for shard in shards]), index=values.index, dtype=object)
+
+
+def normalize_distinct(values, normalizer, workers=1):
+    """
+    Aplica 'normalizer' apenas aos valores distintos da coluna (nulos viram string vazia)
+    e redistribui o resultado para as linhas via códigos inteiros. Retorna uma coluna category.
+    Com 'workers' > 1, os valores distintos são normalizados no pool de processos (ver normalize_values).
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    uniques = pd.Series(np.asarray(uniques, dtype=object), dtype=object).astype(str)
+    normalized = pd.concat([normalize_values(uniques, normalizer, workers), pd.Series([''])], ignore_index=True)
+    normalized_codes, categories = pd.factorize(normalized)
+    codes[codes == -1] = len(uniques)  # nulos apontam para a string vazia acrescentada no final
+    return pd.Series(pd.Categorical.from_codes(normalized_codes[codes], categories=categories), index=values.index)
+
+
+def normalize_columns(data, workers=1):
+    """
+    Retorna {campo: coluna normalizada} para título, domínio, URL e processo, reaproveitando as colunas
+    de NORMALIZED_COLUMNS já presentes no DataFrame e normalizando (uma vez por valor distinto) as que faltarem.
+    """
+    normalized = {}
+    for field, column in NORMALIZED_COLUMNS.items():
+        if column in data.columns:
+            normalized[field] = data[column]
+        else:
+            normalized[field] = normalize_distinct(data[SOURCE_COLUMNS[field]], _NORMALIZERS[field], workers)
+    return normalized
+
+
+def add_normalized_columns(data, workers=1):
+    """
+    Estágio único de normalização: acrescenta ao DataFrame as colunas de NORMALIZED_COLUMNS.
+    'workers' > 1 normaliza os valores distintos em vários processos.
+    """
+    for field, values in normalize_columns(data, workers).items():
+        data[NORMALIZED_COLUMNS[field]] = values
+    return data
+
+
+def build_fields(data):
+    """
+    Deriva os campos de texto usados pelas regras de classificação a partir das colunas normalizadas.
+    """
+    normalized = normalize_columns(data)
+    title = _as_text(normalized['title'])
+    domain = _as_text(normalized['domain'])
+    url = _as_text(normalized['url'])
+    return {
+        'title': title,
+        'domain': domain,
+        'url': url,
+        'title2': _renormalize(title),
+        'domain2': _renormalize(domain),
+        'url2': _renormalize(url),
+        'process': _as_text(normalized['process']),
+        'process_raw': _as_text(data[SOURCE_COLUMNS['process']]),
+    }
+
+
+def _matches(fields, patterns, rows):
+    """
+    Retorna a máscara (sobre as linhas 'rows') das linhas em que algum campo casa com seu regex.
+    """
+    mask = np.zeros(len(rows), dtype=bool)
+    for field, pattern in patterns.items():
+        mask |= fields[field].iloc[rows].str.contains(pattern).to_numpy()
+    return mask
+
+
+def classify_fields(fields, compiled=COMPILED_RULES):
+    """
+    Classifica todas as linhas a partir dos campos derivados, respeitando a prioridade das categorias.
+    Retorna três arrays: Classificação, SubClassificação e Tipo.
+    """
+    size = len(next(iter(fields.values())))
+    classification = np.full(size, DEFAULT_CLASSIFICATION[0], dtype=object)
+    subclassification = np.full(size, DEFAULT_CLASSIFICATION[1], dtype=object)
+    tipo = np.full(size, DEFAULT_CLASSIFICATION[2], dtype=object)
+
+    # Pré-filtro: linhas sem nenhuma palavra-chave em nenhum campo ficam como "Outros"
+    pending = np.flatnonzero(_matches(fields, compiled['prefilter'], np.arange(size)))
+
+    for category in compiled['categories']:
+        if pending.size == 0:
+            break
+        hit = _matches(fields, category['match'], pending)
+        rows = pending[hit]
+        pending = pending[~hit]
+        if rows.size == 0:
+            continue
+        classification[rows] = category['classification']
+        tipo[rows] = category['tipo']
+        for name, patterns in category['subclassifications']:
+            if rows.size == 0:
+                break
+            sub_hit = _matches(fields, patterns, rows)
+            subclassification[rows[sub_hit]] = name
+            rows = rows[~sub_hit]
+
+    return classification, subclassification, tipo
+
+
+def classify_values(fields, compiled=COMPILED_RULES):
+    """
+    Classifica uma única atividade a partir de seus campos derivados ({campo: texto}, ver SOURCE_COLUMNS).
+    Retorna (Classificação, SubClassificação, Tipo).
+    """
+    if not any(pattern.search(fields[field]) for field, pattern in compiled['prefilter'].items()):
+        return DEFAULT_CLASSIFICATION
+    for category in compiled['categories']:
+        if any(pattern.search(fields[field]) for field, pattern in category['match'].items()):
+            for name, patterns in category['subclassifications']:
+                if any(pattern.search(fields[field]) for field, pattern in patterns.items()):
+                    return category['classification'], name, category['tipo']
+            return category['classification'], None, category['tipo']
+    return DEFAULT_CLASSIFICATION
+
+
+# Prioridade atribuída às atividades que não casam com nenhuma categoria ("Outros"): depois de todas as categorias
+DEFAULT_PRIORITY = 2 ** 31 - 1
+
+
+def group_fingerprints(rules=RULES):
+    """
+    Retorna {grupo: (prioridade, hash das linhas do grupo)}. A prioridade do grupo é a menor prioridade entre suas
+    linhas, a mesma usada por compile_rules para ordenar as categorias.
+    """
+    groups = {}
+    for rule in sorted(rules, key=lambda rule: rule['priority']):
+        groups.setdefault(rule['group'], []).append(rule)
+    return {group: (group_rules[0]['priority'],
+                    hashlib.sha256(json.dumps(group_rules, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest())
+            for group, group_rules in groups.items()}
+
+
+def result_priorities(rules=RULES):
+    """
+    Retorna {(Classificação, SubClassificação): prioridade} com a maior prioridade entre os grupos capazes de produzir
+    esse resultado (grupos diferentes podem ter a mesma categoria, ex.: "Pessoais"). Serve para saber, a partir de um
+    resultado já gravado, se uma mudança nas regras pode alterá-lo.
+    """
+    priorities = {}
+    fingerprints = group_fingerprints(rules)
+    for rule in rules:
+        group_priority = fingerprints[rule['group']][0]
+        for result in ((rule['category'], rule['subcategory']), (rule['category'], None)):
+            priorities[result] = max(priorities.get(result, group_priority), group_priority)
+    return priorities
+
+
+def factorize_inputs(columns):
+    """
+    Fatora as colunas de entrada da classificação em um único código inteiro por linha.
+    Retorna (códigos, posições da primeira ocorrência de cada combinação distinta).
+    """
+    combined = None
+    for values in columns:
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        codes = codes.astype(np.int64) + 1  # nulos (-1) passam a ser o código 0
+        if combined is None:
+            combined = codes
+        else:
+            # Re-fatora a cada coluna para manter os códigos compactos e evitar overflow
+            combined, _ = pd.factorize(combined * (len(uniques) + 1) + codes)
+    _, first_rows, codes = np.unique(combined, return_index=True, return_inverse=True)
+    return codes.reshape(-1), first_rows
+
+
+RESULT_COLUMNS = ['Classificação', 'SubClassificação', 'Tipo']
+
+# Id do processo no dicionário utWin_ProcessDic, devolvido por build_query
+PROCESS_ID_COLUMN = 'ProcessId'
+
+_PROCESS_POOLS = {}
+
+
+def get_process_pool(workers):
+    """
+    Retorna (criando na primeira chamada) o pool de processos com 'workers' processos,
+    reaproveitado entre chamadas para não pagar a inicialização dos processos a cada bloco.
+    """
+    if workers not in _PROCESS_POOLS:
+        _PROCESS_POOLS[workers] = ProcessPoolExecutor(max_workers=workers)
+    return _PROCESS_POOLS[workers]
+
+
+def warm_up_process_pool(workers):
+    """
+    Cria o pool de 'workers' processos e executa uma classificação mínima em cada um, para que a primeira
+    chamada medida (ex.: benchmark) não pague a criação dos processos.
+    """
+    if workers <= 1:
+        return
+    fields = build_fields(pd.DataFrame({column: [''] * workers for column in SOURCE_COLUMNS.values()}))
+    classify_fields_parallel(fields, workers)
+
+
+def _to_ipc(table):
+    """
+    Serializa uma tabela Arrow no formato IPC (bytes contíguos, sem pickle de objetos Python por célula).
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _from_ipc(payload):
+    return pa.ipc.open_stream(payload).read_all()
+
+
+def _classify_shard(payload):
+    """
+    Executado nos processos do pool: recebe um lote de entradas distintas em Arrow IPC
+    e devolve as três colunas de resultado, também em Arrow IPC (dictionary-encoded).
+    """
+    shard = _from_ipc(payload).to_pandas()
+    fields = {name: shard[name] for name in shard.columns}
+    results = classify_fields(fields)
+    return _to_ipc(pa.table({name: pa.array(values, type=pa.string()).dictionary_encode()
+                             for name, values in zip(RESULT_COLUMNS, results)}))
+
+
+def classify_fields_parallel(fields, workers):
+    """
+    Divide os campos em 'workers' lotes contíguos, classifica cada lote em um processo separado
+    e junta os resultados na ordem original.
+    """
+    size = len(next(iter(fields.values())))
+    bounds = np.linspace(0, size, workers + 1, dtype=np.int64)
+    payloads = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        payloads.append(_to_ipc(pa.table({name: pa.array(values.iloc[start:stop], type=pa.string())
+                                          for name, values in fields.items()})))
+    shards = [_from_ipc(result).to_pandas() for result in get_process_pool(workers).map(_classify_shard, payloads)]
+    merged = []
+    for name in RESULT_COLUMNS:
+        values = np.concatenate([shard[name].to_numpy(dtype=object) for shard in shards])
+        values[pd.isna(values)] = None  # Mantém None (e não NaN) como em classify_fields
+        merged.append(values)
+    return tuple(merged)
+
+
+def classify_distinct(data, cache=None, workers=1, min_rows_per_worker=10000):
+    """
+    Classifica cada combinação distinta de (ProcessName, WindowTitle, Domain, URL) uma única vez
+    e distribui o resultado para as linhas via códigos inteiros. Com 'cache', reaproveita e alimenta o dicionário de classificações.
+    Com 'workers' > 1, as combinações ainda não classificadas são distribuídas entre processos
+    (apenas quando há pelo menos 'min_rows_per_worker' combinações por processo).
+    O 'cache' é um ClassificationStore (classification_store.py) ou outro objeto com make_keys/get_many/put_many,
+    consultados e alimentados uma vez por lote de combinações distintas.
+    """
+    # Combinações distintas sobre os textos já normalizados (e o processo original, usado pelas regras de PDF e Skype).
+    # Com ProcessId (id do dicionário de processos) no resultado, ele também entra na combinação.
+    normalized = normalize_columns(data, workers)
+    inputs = pd.DataFrame({SOURCE_COLUMNS['process']: data[SOURCE_COLUMNS['process']]})
+    if PROCESS_ID_COLUMN in data.columns:
+        inputs[PROCESS_ID_COLUMN] = data[PROCESS_ID_COLUMN]
+    for field, column in NORMALIZED_COLUMNS.items():
+        inputs[column] = normalized[field]
+    key_columns = [column for column in (PROCESS_ID_COLUMN, SOURCE_COLUMNS['process']) if column in inputs.columns]
+    codes, first_rows = factorize_inputs([inputs[column] for column in key_columns] +
+                                         [inputs[NORMALIZED_COLUMNS[field]] for field in ('title', 'domain', 'url')])
+    distinct = inputs.iloc[first_rows]
+    fields = build_fields(distinct)
+
+    results = np.empty((len(first_rows), 3), dtype=object)
+    pending = np.arange(len(first_rows))
+    if cache is not None:
+        keys = cache.make_keys(distinct, fields)
+        missing = []
+        for position, result in enumerate(cache.get_many(keys)):
+            if result is None:
+                missing.append(position)
+            else:
+                results[position] = result
+        pending = np.asarray(missing, dtype=np.int64)
+
+    if pending.size:
+        pending_fields = {name: values.iloc[pending] for name, values in fields.items()}
+        workers = min(workers or 1, pending.size // min_rows_per_worker)
+        if workers > 1:
+            classification, subclassification, tipo = classify_fields_parallel(pending_fields, workers)
+        else:
+            classification, subclassification, tipo = classify_fields(pending_fields)
+        results[pending, 0] = classification
+        results[pending, 1] = subclassification
+        results[pending, 2] = tipo
+        if cache is not None:
+            cache.put_many([keys[position] for position in pending], [tuple(results[position]) for position in pending])
+
+    # Resultados como category: as categorias vêm das combinações distintas e os códigos são só reindexados
+    return tuple(_broadcast_categorical(results[:, column], codes) for column in range(3))
+
+
+def _broadcast_categorical(distinct_values, codes):
+    categorical = pd.Categorical(distinct_values)
+    return pd.Categorical.from_codes(categorical.codes[codes], dtype=categorical.dtype)
+
+
+def classify_dataframe(data, memoize=True, cache=None, workers=None):
+    """
+    Classifica o DataFrame inteiro de forma vetorizada, com o mesmo resultado de data.apply(classify_activity, axis=1).
+    Com 'memoize', cada combinação distinta de entradas é classificada uma única vez (ver classify_distinct);
+    'workers' > 1 distribui essas combinações entre processos.
+    """
+    if memoize or cache is not None or (workers or 1) > 1:
+        classification, subclassification, tipo = classify_distinct(data, cache=cache, workers=workers)
+    else:
+        classification, subclassification, tipo = (pd.Categorical(values) for values in classify_fields(build_fields(data)))
+    classified_data = data.copy()
+    classified_data['Classificação'] = classification
+    classified_data['SubClassificação'] = subclassification
+    classified_data['Tipo'] = tipo
+    return classified_data
@@ -0,0 +1,164 @@
+import time
+import sqlite3
+import hashlib
+from classification_engine import (RULES, PROCESS_ID_COLUMN, DEFAULT_CLASSIFICATION, DEFAULT_PRIORITY,
+                                   group_fingerprints, result_priorities)
+
+
+class ClassificationStore:
+    """
+    Dicionário persistente (SQLite) de classificações, no mesmo espírito das tabelas de dicionário do banco de origem
+    (utWin_ProcessDic, utWin_UserNameDic): a chave é o ProcessId mais um hash do título, domínio e URL normalizados,
+    e o valor é (Classificação, SubClassificação, Tipo). Cada entrada guarda a prioridade do grupo de regras que
+    a produziu. Ao abrir o arquivo, os hashes de cada grupo de regras são comparados com os da última execução e só
+    as entradas que uma mudança pode afetar são descartadas: as classificadas pelo grupo alterado ou por grupos de
+    menor precedência (inclusive "Outros"), já que um grupo anterior alterado pode passar a capturá-las.
+    O dicionário guarda no máximo 'max_entries' entradas: cada uma registra quando foi usada pela última vez, e
+    save() descarta as usadas há mais tempo (LRU) além do limite.
+    classify_distinct o consulta em lote (make_keys/get_many/put_many).
+    """
+
+    def __init__(self, path, rules=RULES, max_entries=500000):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS rule_groups (
+                group_name TEXT PRIMARY KEY,
+                priority INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS classifications (
+                process_id INTEGER NOT NULL,
+                text_hash BLOB NOT NULL,
+                classification TEXT,
+                subclassification TEXT,
+                tipo TEXT,
+                priority INTEGER NOT NULL,
+                last_used REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (process_id, text_hash)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS classifications_priority ON classifications (priority);
+            CREATE TEMP TABLE lookup_keys (
+                position INTEGER PRIMARY KEY,
+                process_id INTEGER NOT NULL,
+                text_hash BLOB NOT NULL
+            );
+        """)
+        # Dicionários gravados antes do limite de tamanho não têm a coluna last_used
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(classifications)")]
+        if 'last_used' not in columns:
+            self.connection.execute("ALTER TABLE classifications ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS classifications_last_used ON classifications (last_used)")
+        self.priorities = result_priorities(rules)
+        self.hits = 0
+        self.misses = 0
+        self.sync_rules(rules)
+
+    def sync_rules(self, rules=RULES):
+        """
+        Compara os grupos de regras atuais com os gravados e invalida as entradas afetadas pelos grupos alterados,
+        incluídos ou removidos.
+        """
+        current = group_fingerprints(rules)
+        saved = {group: (priority, rule_hash) for group, priority, rule_hash
+                 in self.connection.execute("SELECT group_name, priority, hash FROM rule_groups")}
+        changed = [group for group in set(current) | set(saved) if current.get(group) != saved.get(group)]
+        if not changed:
+            return
+        # A mudança de maior precedência define o corte (a prioridade antiga e a nova contam, caso o grupo tenha mudado de lugar)
+        cutoff = min(fingerprint[0] for group in changed for fingerprint in (current.get(group), saved.get(group))
+                     if fingerprint is not None)
+        with self.connection:
+            invalidated = self.connection.execute("DELETE FROM classifications WHERE priority >= ?", (cutoff,)).rowcount
+            self.connection.execute("DELETE FROM rule_groups")
+            self.connection.executemany("INSERT INTO rule_groups VALUES (?, ?, ?)",
+                                        [(group, priority, rule_hash) for group, (priority, rule_hash) in current.items()])
+        if saved:
+            print(f"Regras alteradas nos grupos {', '.join(sorted(changed))}; {invalidated} classificações descartadas.")
+
+    def make_keys(self, distinct, fields):
+        """
+        Chaves do dicionário para as combinações distintas: (ProcessId, hash de título, domínio e URL normalizados).
+        """
+        if PROCESS_ID_COLUMN not in distinct.columns:
+            raise ValueError(f"O dicionário de classificações precisa da coluna {PROCESS_ID_COLUMN} (ver build_query).")
+        hashes = [hashlib.blake2b('\x1f'.join(texts).encode('utf-8'), digest_size=16).digest()
+                  for texts in zip(fields['title'], fields['domain'], fields['url'])]
+        return list(zip(distinct[PROCESS_ID_COLUMN].astype('int64').tolist(), hashes))
+
+    def get_many(self, keys):
+        """
+        Busca as chaves em uma única consulta (via tabela temporária) e retorna o resultado de cada uma, ou None.
+        As entradas encontradas são marcadas como usadas agora.
+        """
+        results = [None] * len(keys)
+        with self.connection:
+            self.connection.execute("DELETE FROM lookup_keys")
+            self.connection.executemany("INSERT INTO lookup_keys VALUES (?, ?, ?)",
+                                        [(position, process_id, text_hash) for position, (process_id, text_hash) in enumerate(keys)])
+            self.connection.execute("""
+                UPDATE classifications SET last_used = ?
+                WHERE EXISTS (SELECT 1 FROM lookup_keys k
+                              WHERE k.process_id = classifications.process_id AND k.text_hash = classifications.text_hash)
+            """, (time.time(),))
+        rows = self.connection.execute("""
+            SELECT k.position, c.classification, c.subclassification, c.tipo
+            FROM lookup_keys k
+            JOIN classifications c ON c.process_id = k.process_id AND c.text_hash = k.text_hash
+        """)
+        for position, classification, subclassification, tipo in rows:
+            results[position] = (classification, subclassification, tipo)
+        found = sum(result is not None for result in results)
+        self.hits += found
+        self.misses += len(keys) - found
+        return results
+
+    def put_many(self, keys, results):
+        now = time.time()
+        rows = []
+        for (process_id, text_hash), (classification, subclassification, tipo) in zip(keys, results):
+            if (classification, subclassification, tipo) == DEFAULT_CLASSIFICATION:
+                priority = DEFAULT_PRIORITY
+            else:
+                priority = self.priorities.get((classification, subclassification), DEFAULT_PRIORITY)
+            rows.append((process_id, text_hash, classification, subclassification, tipo, priority, now))
+        with self.connection:
+            self.connection.executemany("""
+                INSERT OR REPLACE INTO classifications
+                    (process_id, text_hash, classification, subclassification, tipo, priority, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self):
+        entries = self.connection.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+        print(f"Dicionário de classificação: {self.hits} acertos, {self.misses} faltas "
+              f"(taxa de acerto {self.hit_rate:.1%}, {entries} entradas em {self.path})")
+
+    def evict(self):
+        """
+        Descarta as entradas usadas há mais tempo até restarem 'max_entries'. Retorna o número de entradas descartadas.
+        """
+        excess = self.connection.execute("SELECT COUNT(*) FROM classifications").fetchone()[0] - self.max_entries
+        if excess <= 0:
+            return 0
+        with self.connection:
+            self.connection.execute("""
+                DELETE FROM classifications
+                WHERE (process_id, text_hash) IN (
+                    SELECT process_id, text_hash FROM classifications ORDER BY last_used LIMIT ?
+                )
+            """, (excess,))
+        return excess
+
+    def save(self):
+        self.evict()
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
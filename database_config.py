@@ -1,20 +1,148 @@
-from sqlalchemy import create_engine
-from sqlalchemy.exc import OperationalError
+import time
+import random
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import DBAPIError
 
-def get_database_engine(db_host, db_name, db_user, db_password):
+# SQLSTATE de erros transitórios: falha/queda de conexão, timeout e deadlock
+TRANSIENT_SQLSTATES = {'08001', '08S01', '08007', 'HYT00', 'HYT01', '40001'}
+
+# Números de erro do SQL Server transitórios: deadlock, banco indisponível ou em failover, limites de recursos
+TRANSIENT_ERROR_NUMBERS = {1205, 4060, 4221, 10053, 10054, 10060, 10928, 10929, 40197, 40501, 40613, 49918, 49919, 49920}
+
+
+class ConnectionMetrics:
+    """
+    Latências (em segundos) das conexões abertas, das consultas executadas (até o primeiro resultado)
+    e das esperas entre tentativas, registradas pelos eventos da engine e pelos retries.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+
+    def summary(self):
+        summary = {}
+        with self._lock:
+            for kind, values in self.latencies.items():
+                values = sorted(values)
+                summary[kind] = {
+                    'count': len(values),
+                    'mean': sum(values) / len(values),
+                    'p50': values[len(values) // 2],
+                    'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+                    'max': values[-1],
+                }
+        return summary
+
+    def report(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"{'latência':<10} {'qtd':>6} {'média (ms)':>11} {'p50 (ms)':>9} {'p95 (ms)':>9} {'máx (ms)':>9}")
+        for kind, entry in summary.items():
+            print(f"{kind:<10} {entry['count']:>6} {entry['mean'] * 1000:>11.1f} {entry['p50'] * 1000:>9.1f} "
+                  f"{entry['p95'] * 1000:>9.1f} {entry['max'] * 1000:>9.1f}")
+
+
+# Métricas de todas as engines do processo
+connection_metrics = ConnectionMetrics()
+
+# Uma engine (e um pool) por configuração de conexão, reaproveitada em todo o processo
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _instrument_engine(engine):
+    # Tempo de abertura de cada conexão física do pool
+    @event.listens_for(engine, 'do_connect')
+    def connect(dialect, connection_record, cargs, cparams):
+        start = time.perf_counter()
+        connection = dialect.loaded_dbapi.connect(*cargs, **cparams)
+        connection_metrics.record('connect', time.perf_counter() - start)
+        return connection
+
+    # Tempo de execução de cada consulta, até o servidor devolver o primeiro resultado
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(connection, cursor, statement, parameters, context, executemany):
+        connection_metrics.record('query', time.perf_counter() - connection.info['query_start'].pop())
+
+    @event.listens_for(engine, 'handle_error')
+    def execute_failed(context):
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+
+def get_database_engine(db_host, db_name, db_user, db_password, pool_size=5, max_overflow=10, pool_recycle=1800,
+                        packet_size=None, login_timeout=15, warm_up=1):
     """
     Cria e retorna a engine de conexão com o banco de dados SQL Server.
     Verifica se a conexão foi bem-sucedida.
+    'pool_size' deve acompanhar o número de consultas simultâneas (ex.: workers da extração paralela).
+    A engine é criada uma vez por configuração e reaproveitada nas chamadas seguintes (um único pool por processo).
+    Conexões são testadas antes do uso (pool_pre_ping) e renovadas após 'pool_recycle' segundos; 'packet_size'
+    (bytes, até 32767) ajusta o tamanho do pacote TDS e 'login_timeout' limita a espera pelo login.
+    Ao criar a engine, abre 'warm_up' conexões (ex.: uma por worker) para que as consultas não paguem o login;
+    se a conexão falhar, levanta RuntimeError em vez de seguir com uma engine inutilizável.
     """
-    connection_string = f"mssql+pyodbc://{db_user}:{db_password}@{db_host}/{db_name}?driver=ODBC+Driver+17+for+SQL+Server"
-    engine = create_engine(connection_string)
-    
-    try:
-        # Testa a conexão
-        with engine.connect() as connection:
+    key = (db_host, db_name, db_user, db_password, pool_size, max_overflow, pool_recycle, packet_size, login_timeout)
+    with _engines_lock:
+        if key in _engines:
+            return _engines[key]
+
+        query = {'driver': 'ODBC Driver 17 for SQL Server'}
+        if packet_size:
+            query['PacketSize'] = str(packet_size)
+        connection_url = URL.create('mssql+pyodbc', username=db_user, password=db_password, host=db_host,
+                                    database=db_name, query=query)
+        engine = create_engine(connection_url, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True,
+                               pool_recycle=pool_recycle, fast_executemany=True, connect_args={'timeout': login_timeout})
+        _instrument_engine(engine)
+
+        try:
+            # Testa a conexão e deixa 'warm_up' conexões abertas no pool
+            connections = [engine.connect() for _ in range(max(1, min(warm_up, pool_size)))]
+            for connection in connections:
+                connection.close()
             print("Conexão com o banco de dados bem-sucedida!")
-    except OperationalError as e:
-        print(f"Erro ao conectar ao banco de dados: {e}")
-    
-    return engine
+        except DBAPIError as e:
+            print(f"Erro ao conectar ao banco de dados: {e}")
+            engine.dispose()
+            raise RuntimeError("Falha ao conectar ao banco de dados") from e
+
+        _engines[key] = engine
+        return engine
 
+
+def is_transient_error(error):
+    """
+    Indica se o erro do banco é transitório (vale tentar de novo): conexão perdida/invalidada, timeout, deadlock
+    ou indisponibilidade temporária do SQL Server. Erros de sintaxe, permissão etc. falham de imediato.
+    """
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    args = getattr(error.orig, 'args', ())
+    if args and args[0] in TRANSIENT_SQLSTATES:
+        return True
+    # O pyodbc inclui o número de erro nativo na mensagem, ex.: "... deadlocked ... (1205) (SQLExecDirectW)"
+    message = ' '.join(str(arg) for arg in args)
+    return any(f"({number})" in message for number in TRANSIENT_ERROR_NUMBERS)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """
+    Espera antes da tentativa seguinte à 'attempt' (0, 1, ...): exponencial com jitter completo,
+    um valor aleatório entre 0 e min(max_delay, base_delay * 2 ** attempt).
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
@@ -0,0 +1,98 @@
+import os
+import json
+import pandas as pd
+from datetime import datetime
+
+
+# Tabelas de atividade consultadas por build_query (cliente e servidor)
+SOURCE_TABLES = [
+    'utWinClient_UserWebActivity',
+    'utWinClient_UserAppActivity',
+    'utWinServer_UserWebActivity',
+    'utWinServer_UserAppActivity',
+]
+
+# Colunas adicionadas por build_query no modo incremental, usadas só para atualizar as marcas
+TRACKING_COLUMNS = ['PartitionID', 'SourceTable']
+
+
+def output_key(basename, formats, csv_compression=None):
+    """
+    Identifica a saída à qual as marcas pertencem: nome base (caminho absoluto), formatos e compressão do CSV.
+    """
+    options = sorted(formats) + ([csv_compression] if csv_compression else [])
+    return f"{os.path.abspath(basename)} [{', '.join(options)}]"
+
+
+class IncrementalState:
+    """
+    Marca d'água (high-water mark) da extração incremental: para cada tabela de origem guarda o último
+    UTCActualSliceId processado, sua PartitionID e a data correspondente. O estado fica em um arquivo JSON
+    ao lado da saída e só é gravado depois que todos os writers terminam, para nunca avançar além do que foi salvo.
+    As marcas são guardadas por saída ('output', ver output_key): outra saída (nome, formatos ou compressão)
+    começa com uma extração completa, em vez de receber só os slices novos da anterior.
+    Linhas que chegarem depois para slices já abaixo da marca não são recuperadas.
+    """
+
+    def __init__(self, path, usernames=None, output=''):
+        self.path = path
+        self.usernames = sorted(usernames or [])
+        self.output = output
+        self.outputs = {}
+        self.marks = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                saved = json.load(file)
+            # Estado gravado antes das marcas por saída: pertence à saída que vinha sendo usada com ele
+            self.outputs = saved['outputs'] if 'outputs' in saved else {output: saved}
+            entry = self.outputs.get(output)
+            if entry is None:
+                print(f"Nenhuma execução incremental anterior para {output}; a extração será completa.")
+            elif entry.get('usernames', []) == self.usernames:
+                self.marks = entry.get('marks', {})
+            else:
+                print("Usuários diferentes da última execução incremental; a extração será completa.")
+
+    @property
+    def is_empty(self):
+        return not self.marks
+
+    def high_water_marks(self):
+        """
+        Retorna {tabela: UTCActualSliceId} no formato esperado por build_query (tabelas sem marca ficam de fora).
+        """
+        return {table: mark['UTCActualSliceId'] for table, mark in self.marks.items()}
+
+    def start_date(self):
+        """
+        Data (YYYY-MM-DD) a partir da qual há slices novos: a menor data entre as marcas de todas as tabelas.
+        Retorna None se alguma tabela ainda não tem marca (nesse caso ela precisa ser lida por inteiro).
+        """
+        if any(table not in self.marks for table in SOURCE_TABLES):
+            return None
+        return min(mark['Date'] for mark in self.marks.values())
+
+    def observe(self, data):
+        """
+        Atualiza as marcas (em memória) com o maior UTCActualSliceId de cada tabela de origem presente no bloco.
+        """
+        if data.empty:
+            return
+        latest = data.loc[data.groupby('SourceTable', observed=True)['UTCActualSliceId'].idxmax()]
+        for row in latest.itertuples(index=False):
+            current = self.marks.get(row.SourceTable)
+            if current is None or int(row.UTCActualSliceId) > current['UTCActualSliceId']:
+                self.marks[row.SourceTable] = {
+                    'UTCActualSliceId': int(row.UTCActualSliceId),
+                    'PartitionID': int(row.PartitionID),
+                    'Date': pd.to_datetime(row.Date).strftime('%Y-%m-%d'),
+                }
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        outputs = dict(self.outputs)
+        outputs[self.output] = {'usernames': self.usernames, 'marks': self.marks,
+                                'updated_at': datetime.now().isoformat(timespec='seconds')}
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'outputs': outputs}, file, indent=2)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+def peak_rss_bytes():
+    """
+    Retorna o pico de memória residente (RSS / peak working set) do processo até agora, em bytes,
+    ou None se a plataforma não informar.
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        if ctypes.windll.psapi.GetProcessMemoryInfo(get_current_process(), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux informa em KB, macOS em bytes
+
+
+class Instrumentation:
+    """
+    Registra, para cada etapa do pipeline, tempo de parede, tempo de CPU do processo, linhas de entrada/saída
+    e pico de RSS. Etapas podem ser aninhadas (ex.: a classificação dentro de process_data) e repetidas
+    (uma vez por bloco no modo streaming); o resumo soma as repetições de cada etapa.
+    O tempo de CPU é o do processo inteiro: com extração paralela, as etapas das threads se sobrepõem,
+    e a CPU gasta nos processos de classificação (CLASSIFICATION_WORKERS) não entra na conta.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Mede o bloco 'with' como a etapa 'name'. O registro é devolvido para o chamador preencher 'rows_out'.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        record = {'stage': name, 'thread': threading.current_thread().name, 'depth': depth,
+                  'rows_in': rows_in, 'rows_out': None}
+        self._local.depth = depth + 1
+        peak_before = peak_rss_bytes()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['start_seconds'] = wall_start - self.origin
+            record['wall_seconds'] = time.perf_counter() - wall_start
+            record['cpu_seconds'] = time.process_time() - cpu_start
+            record['peak_rss'] = peak_rss_bytes()
+            if record['peak_rss'] is not None and peak_before is not None:
+                record['peak_rss_growth'] = record['peak_rss'] - peak_before
+            self._local.depth = depth
+            self.records.append(record)
+
+    def measure_chunks(self, chunks, first_stage='query', stage='transfer'):
+        """
+        Repassa os blocos de 'chunks' medindo o tempo gasto esperando cada um: a espera pelo primeiro bloco
+        (execução da consulta no servidor) fica em 'first_stage' e a dos demais (transferência) em 'stage'.
+        """
+        iterator = iter(chunks)
+        name = first_stage
+        while True:
+            with self.stage(name) as record:
+                chunk = next(iterator, None)
+                record['rows_out'] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+            name = stage
+
+    def summary(self):
+        """
+        Agrega os registros por etapa, na ordem em que cada etapa apareceu pela primeira vez.
+        """
+        stages = {}
+        for record in sorted(self.records, key=lambda record: record['start_seconds']):
+            entry = stages.setdefault(record['stage'], {
+                'stage': record['stage'], 'depth': record['depth'], 'calls': 0, 'wall_seconds': 0.0,
+                'cpu_seconds': 0.0, 'rows_in': None, 'rows_out': None, 'peak_rss': None,
+            })
+            entry['calls'] += 1
+            entry['wall_seconds'] += record['wall_seconds']
+            entry['cpu_seconds'] += record['cpu_seconds']
+            for key in ('rows_in', 'rows_out'):
+                if record[key] is not None:
+                    entry[key] = (entry[key] or 0) + record[key]
+            if record['peak_rss'] is not None:
+                entry['peak_rss'] = max(entry['peak_rss'] or 0, record['peak_rss'])
+        for entry in stages.values():
+            rows = entry['rows_in'] if entry['rows_in'] is not None else entry['rows_out']
+            entry['rows_per_second'] = rows / entry['wall_seconds'] if rows and entry['wall_seconds'] else None
+        return list(stages.values())
+
+    def report(self):
+        """
+        Imprime a tabela-resumo das etapas.
+        """
+        if not self.records:
+            return
+        print(f"{'etapa':<28} {'chamadas':>8} {'tempo (s)':>10} {'CPU (s)':>9} {'entrada':>11} {'saída':>11} "
+              f"{'linhas/s':>11} {'pico RSS (MB)':>14}")
+        for entry in self.summary():
+            name = '  ' * entry['depth'] + entry['stage']
+            rows_in = '' if entry['rows_in'] is None else entry['rows_in']
+            rows_out = '' if entry['rows_out'] is None else entry['rows_out']
+            rate = '' if entry['rows_per_second'] is None else f"{entry['rows_per_second']:.0f}"
+            peak = '' if entry['peak_rss'] is None else f"{entry['peak_rss'] / 2 ** 20:.0f}"
+            print(f"{name:<28} {entry['calls']:>8} {entry['wall_seconds']:>10.2f} {entry['cpu_seconds']:>9.2f} "
+                  f"{rows_in:>11} {rows_out:>11} {rate:>11} {peak:>14}")
+
+    def write_trace(self, path):
+        """
+        Grava os registros no formato Trace Event (JSON, abre em chrome://tracing ou no Perfetto), com o resumo junto.
+        """
+        events = [{
+            'name': record['stage'],
+            'ph': 'X',
+            'ts': round(record['start_seconds'] * 1e6),
+            'dur': round(record['wall_seconds'] * 1e6),
+            'pid': os.getpid(),
+            'tid': record['thread'],
+            'args': {key: value for key, value in record.items() if key not in ('stage', 'thread', 'start_seconds')},
+        } for record in self.records]
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events, 'summary': self.summary()}, file, indent=1, ensure_ascii=False)
+        print(f"Trace de execução salvo em {path}")
+
+
+# Instância usada pelo pipeline de main.py
+pipeline_metrics = Instrumentation()
+stage = pipeline_metrics.stage
+measure_chunks = pipeline_metrics.measure_chunks
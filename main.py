@@ -1,123 +1,735 @@
 import pandas as pd
-from database_config import get_database_engine
-from utilities import convert_seconds_to_hhmmss, classify_activity, get_day_of_year  # Importar a função de utilidade
+from pandas.api.types import union_categoricals
+from database_config import get_database_engine, connection_metrics, is_transient_error, backoff_delay
+from utilities import convert_seconds_to_hhmmss, format_timedelta, map_distinct  # Importar a função de utilidade
+from partition_planner import plan_partitions, partition_predicate, partition_ids
+from classification_engine import classify_dataframe, add_normalized_columns, NORMALIZED_COLUMNS
+from classification_store import ClassificationStore
+from incremental import IncrementalState, TRACKING_COLUMNS, output_key
+from instrumentation import pipeline_metrics, stage, measure_chunks
+from pipeline import Pipeline
+from query_cache import QueryResultCache
+from slice_dates import DateMapping, DATE_MAPPINGS, UDF_DATE_EXPRESSION, load_date_mapping
 import re
 import time
-from sqlalchemy.exc import OperationalError
+import zlib
+import sys
+import json
+import argparse
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 from dotenv import load_dotenv
 import os
 from openpyxl import Workbook
-from openpyxl.utils.exceptions import IllegalCharacterError
-from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta, date, time as dt_time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from collections import deque
 
 
-def execute_query_with_retry(engine, query, retries=3, delay=5):
+# Esquema de tipos do resultado de build_query: colunas de texto de baixa cardinalidade são lidas como category
+DTYPE_SCHEMA = {
+    'OrganizationId': 'category',
+    'MachineName': 'category',
+    'IpAddress': 'category',
+    'HostName': 'category',
+    'UserName': 'category',
+    'ProcessName': 'category',
+    'Domain': 'category',
+    'SourceTable': 'category',
+}
+
+def apply_dtype_schema(data, schema=DTYPE_SCHEMA):
+    """
+    Converte as colunas presentes no DataFrame para os tipos de 'schema'.
+    """
+    return data.astype({column: dtype for column, dtype in schema.items() if column in data.columns})
+
+def memory_per_row(data):
+    """
+    Retorna o uso de memória do DataFrame (incluindo o conteúdo das strings) em bytes por linha.
+    """
+    return data.memory_usage(deep=True).sum() / max(len(data), 1)
+
+def typed_chunks(chunks, report_memory=True):
+    """
+    Aplica DTYPE_SCHEMA a cada bloco lido do banco. No primeiro bloco, informa a memória por linha antes e depois.
+    """
+    for index, chunk in enumerate(chunks):
+        typed_chunk = apply_dtype_schema(chunk)
+        if report_memory and index == 0 and len(chunk):
+            print(f"Memória por linha (primeiro bloco): {memory_per_row(chunk):.0f} bytes com object, "
+                  f"{memory_per_row(typed_chunk):.0f} bytes com category")
+        yield typed_chunk
+
+def concat_typed_chunks(chunks):
+    """
+    Concatena blocos mantendo as colunas category como category (pd.concat as transformaria em object
+    quando as categorias dos blocos diferem).
     """
-    Executa a consulta SQL com lógica de retry em caso de falha de transação.
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0]
+    categorical = [column for column in chunks[0].columns if isinstance(chunks[0][column].dtype, pd.CategoricalDtype)]
+    data = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for column in categorical:
+        data[column] = union_categoricals([chunk[column] for chunk in chunks], ignore_order=True)
+    return data[chunks[0].columns]
+
+def wait_before_retry(error, attempt, retries, delay):
     """
-    attempt = 0
-    while attempt < retries:
+    Decide se a falha 'error' na tentativa 'attempt' (a partir de 0) merece nova tentativa: só erros transitórios
+    (ver is_transient_error), com espera exponencial com jitter a partir de 'delay' segundos.
+    Erros permanentes são relançados; esgotadas as tentativas, levanta RuntimeError.
+    """
+    if not is_transient_error(error):
+        raise error
+    if attempt + 1 >= retries:
+        raise RuntimeError("Falha ao executar a consulta após várias tentativas") from error
+    wait_seconds = backoff_delay(attempt, delay)
+    print(f"Erro transitório, tentativa {attempt + 1} de {retries}; nova tentativa em {wait_seconds:.1f}s: {error}")
+    connection_metrics.record('retry', wait_seconds)
+    time.sleep(wait_seconds)  # Aguarda antes de tentar novamente
+
+def execute_query_with_retry(engine, query, retries=3, delay=1, chunksize=100000, report_memory=True):
+    """
+    Executa a consulta SQL com lógica de retry em caso de falha transitória (conexão, timeout, deadlock).
+    O resultado é lido em blocos e convertido para DTYPE_SCHEMA bloco a bloco, de modo que o DataFrame
+    completo nunca existe com as colunas de texto como object.
+    """
+    for attempt in range(retries):
         try:
             with engine.connect() as connection:
-                data = pd.read_sql(query, connection)
+                chunks = measure_chunks(pd.read_sql(query, connection, chunksize=chunksize))
+                data = concat_typed_chunks(list(typed_chunks(chunks, report_memory=report_memory)))
             return data
-        except OperationalError as e:
-            print(f"Erro de transação, tentativa {attempt + 1} de {retries}: {e}")
-            attempt += 1
-            time.sleep(delay)  # Aguarda antes de tentar novamente
+        except DBAPIError as e:
+            wait_before_retry(e, attempt, retries, delay)
     raise RuntimeError("Falha ao executar a consulta após várias tentativas")
 
+def execute_query_in_chunks(engine, query, chunksize=100000, retries=3, delay=1):
+    """
+    Executa a consulta SQL com cursor no servidor (stream_results) e devolve o resultado em blocos de 'chunksize' linhas.
+    O retry só vale enquanto nenhum bloco foi entregue, para não duplicar linhas já processadas.
+    """
+    for attempt in range(retries):
+        delivered = False
+        try:
+            with engine.connect().execution_options(stream_results=True) as connection:
+                for chunk in typed_chunks(measure_chunks(pd.read_sql(query, connection, chunksize=chunksize))):
+                    delivered = True
+                    yield chunk
+            return
+        except DBAPIError as e:
+            if delivered:
+                raise
+            wait_before_retry(e, attempt, retries, delay)
+    raise RuntimeError("Falha ao executar a consulta após várias tentativas")
+
+def iter_day_slices(start_date, end_date):
+    """
+    Divide o intervalo de datas (YYYY-MM-DD) em fatias de um dia, ou seja, uma PartitionID por fatia.
+    """
+    day = datetime.strptime(start_date, "%Y-%m-%d")
+    last_day = datetime.strptime(end_date, "%Y-%m-%d")
+    while day <= last_day:
+        yield day.strftime("%Y-%m-%d")
+        day += timedelta(days=1)
+
+def extract_partitions_parallel(engine, start_date, end_date, usernames=None, max_workers=4, retries=3, delay=1,
+                                date_mapping=None, result_cache=None):
+    """
+    Extrai o intervalo de datas em fatias diárias (por PartitionID), executadas em paralelo por 'max_workers' threads
+    sobre o pool de conexões da engine. Cada fatia tem seu próprio retry e é devolvida assim que termina,
+    sem esperar pelas demais. No máximo 2 * max_workers fatias ficam em andamento ou aguardando consumo.
+    'date_mapping' (ver slice_dates.py) define como a coluna Date é obtida em cada fatia.
+    Com 'result_cache' (ver query_cache.py), cada fatia é guardada em separado: dias já fechados não voltam ao banco.
+    """
+    date_mapping = date_mapping or DateMapping()
+    slices = iter(iter_day_slices(start_date, end_date))
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+
+    def extract_day(day):
+        query_args = dict(start_date=day, end_date=day, **date_mapping.query_options(day, day))
+        query = build_query(usernames=usernames, **query_args)
+        fetch = lambda: [execute_query_with_retry(engine, query, retries, delay, report_memory=False)]
+        return concat_typed_chunks(list(with_result_cache(result_cache, query_args, usernames, fetch)))
+
+    def submit_next():
+        day = next(slices, None)
+        if day is not None:
+            pending[executor.submit(extract_day, day)] = day
+
+    try:
+        for _ in range(max_workers * 2):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                day = pending.pop(future)
+                try:
+                    data = future.result()
+                except RuntimeError as e:
+                    raise RuntimeError(f"Falha ao extrair a fatia de {day}: {e}") from e
+                submit_next()
+                print(f"Fatia de {day} extraída: {len(data)} registros")
+                yield date_mapping.attach(data)
+    finally:
+        # Em caso de erro (ou se o consumidor parar antes), não inicia as fatias restantes
+        executor.shutdown(wait=True, cancel_futures=True)
+
+COMPUTER_NAME_PATTERN = re.compile(r'df[-\w]*')
+
 def extract_computer_name(name):
     """
-    Extrai a palavra do nome do computador que começa com 'df', 
+    Extrai a palavra do nome do computador que começa com 'df'.
+    Retorna None se não houver essa palavra ou se o nome for nulo.
     """
-    match = re.search(r'df[-\w]*', name.lower())
+    if not isinstance(name, str):
+        return None
+    match = COMPUTER_NAME_PATTERN.search(name.lower())
     if match:
         return match.group(0)
     return None
 
-def process_data(data):
+# Colunas derivadas por process_data, gravadas como date, time e "Segundos" (ActivityTime numérico)
+DATE_ONLY_COLUMN = 'Data Apenas'
+TIME_OF_DAY_COLUMN = 'Hora Apenas'
+SECONDS_COLUMN = 'Segundos'
+
+def process_data(data, cache=None, workers=None):
     """
     Processa o DataFrame: converte datas, tempos e classifica atividades.
+    Se um ClassificationStore for informado, combinações já vistas em execuções anteriores não são reclassificadas.
+    'workers' > 1 distribui a classificação entre vários processos.
     """
-    # Separar a coluna "Date" em "Data" e "Hora"
+    # Separar a coluna "Date" em "Data" (datetime64 à meia-noite) e "Hora" (timedelta64 desde a meia-noite);
+    # a conversão para date/time ou texto fica para os writers (ver format_derived_columns)
     data['Date'] = pd.to_datetime(data['Date'])  # Converte para o tipo datetime
-    data['Data Apenas'] = data['Date'].dt.date  # Extrai apenas a data
-    data['Hora Apenas'] = data['Date'].dt.time  # Extrai apenas o horário
+    data[DATE_ONLY_COLUMN] = data['Date'].dt.normalize()
+    data[TIME_OF_DAY_COLUMN] = data['Date'] - data[DATE_ONLY_COLUMN]
 
-    # Converter "ActivityTime" de segundos para HH:MM:SS
-    data['ActivityTime'] = data['ActivityTime'].apply(lambda x: convert_seconds_to_hhmmss(int(x)))
+    # "ActivityTime" vira timedelta64 (gravado como HH:MM:SS), e os segundos originais ficam em "Segundos"
+    seconds = data['ActivityTime'].astype('int64')
+    data['ActivityTime'] = pd.to_timedelta(seconds, unit='s')
+    data.insert(data.columns.get_loc('ActivityTime') + 1, SECONDS_COLUMN, seconds)
 
-    # Aplicar a função de classificação
-    classified_data = data.apply(classify_activity, axis=1)
+    # Normalizar título, domínio, URL e processo uma única vez (por valor distinto); as regras leem essas colunas
+    add_normalized_columns(data, workers)
+
+    # Aplicar a classificação vetorizada (mesmo resultado de data.apply(classify_activity, axis=1))
+    with stage('classify_dataframe', rows_in=len(data)) as record:
+        classified_data = classify_dataframe(data, cache=cache, workers=workers)
+        record['rows_out'] = len(classified_data)
+    classified_data = classified_data.drop(columns=list(NORMALIZED_COLUMNS.values()))
 
     # Verificar se a coluna 'Nome do Computador' está no dataset e aplicar a extração
     if 'MachineName' in data.columns:
-        classified_data['Nome Extraído'] = data['MachineName'].apply(extract_computer_name)
+        # Poucos milhares de máquinas distintas: a extração roda uma vez por nome
+        classified_data['Nome Extraído'] = map_distinct(data['MachineName'], extract_computer_name)
     else:
         print("Coluna 'MachineName' não encontrada no dataset.")
 
     return classified_data
 
+# Chave do relatório agregado (modo --aggregate)
+SUMMARY_KEYS = ['UserName', 'Date', 'Classificação', 'SubClassificação', 'Tipo']
+
+def summarize_activity(data, cache=None, workers=None):
+    """
+    Processa o resultado de build_query(aggregate=True): classifica cada combinação distinta de
+    (ProcessName, WindowTitle, Domain, URL_Name) e soma o tempo e os registros por usuário, dia e classificação.
+    """
+    data['Date'] = pd.to_datetime(data['Date'])
+    add_normalized_columns(data, workers)
+    with stage('classify_dataframe', rows_in=len(data)) as record:
+        classified_data = classify_dataframe(data, cache=cache, workers=workers)
+        record['rows_out'] = len(classified_data)
+
+    summary = (classified_data.groupby(SUMMARY_KEYS, observed=True, dropna=False, sort=True)
+                              .agg(Segundos=('ActivityTime', 'sum'), Registros=('Registros', 'sum'))
+                              .reset_index())
+    summary['Tempo Total'] = map_distinct(summary['Segundos'], lambda seconds: convert_seconds_to_hhmmss(int(seconds)))
+    return summary[SUMMARY_KEYS + ['Tempo Total', 'Segundos', 'Registros']]
+
 def clean_illegal_characters(text):
     # Remove caracteres não permitidos no Excel (como "‼")
     if isinstance(text, str):
         return re.sub(r'[^\x20-\x7E]', '', text)  # Remove caracteres fora do intervalo ASCII imprimível
     return text
 
-def save_to_excel(data, filename='dados_classificados.xlsx', max_rows_per_sheet=1000000):
+def clean_string_columns(data):
+    """
+    Versão vetorizada de clean_illegal_characters: aplica um único .str.replace por coluna de texto,
+    sem tocar nas colunas numéricas e de data. Retorna uma cópia rasa do DataFrame.
+    """
+    data = data.copy(deep=False)
+    for column in data.columns:
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Colunas category: limpa só as categorias (poucos valores distintos)
+            data[column] = values.map(clean_illegal_characters, na_action='ignore')
+            continue
+        if values.dtype != object:
+            continue
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred == 'string':
+            data[column] = values.str.replace(r'[^\x20-\x7E]', '', regex=True)
+        elif inferred.startswith('mixed'):
+            # Coluna com textos e outros tipos: limpa só as células de texto
+            is_text = values.map(lambda value: isinstance(value, str)).astype(bool)
+            data[column] = values.where(~is_text, values[is_text].str.replace(r'[^\x20-\x7E]', '', regex=True))
+    return data
+
+def save_to_excel(data, filename='dados_classificados.xlsx', max_rows_per_sheet=1000000, block_size=100000):
     """
     Salva o DataFrame em um arquivo Excel (.xlsx), criando novas planilhas se o limite de 1 milhão de linhas for excedido.
+    A escrita é feita em blocos pelo StreamingExcelWriter (modo write-only), sem montar a planilha inteira em memória.
     """
-    # Verifica o número de linhas no DataFrame
-    num_rows = data.shape[0]
+    excel_writer = StreamingExcelWriter(filename, max_rows_per_sheet=max_rows_per_sheet)
+    for i in range(0, data.shape[0], block_size):
+        excel_writer.append(data.iloc[i:i + block_size])
+    excel_writer.close()
 
-    # Limpa caracteres ilegais antes de salvar
-    data = data.applymap(clean_illegal_characters)
-    
-    if num_rows <= max_rows_per_sheet:
-        # Se o número de linhas for menor ou igual ao limite, salva normalmente
-        try:
-            data.to_excel(filename, index=False, engine='openpyxl')
-            print(f"Exportação para Excel concluída com sucesso! Arquivo salvo como {filename}")
-        except IllegalCharacterError as e:
-            print(f"Erro ao salvar o arquivo Excel devido a caracteres ilegais: {e}")
-    else:
-        # Criar um novo arquivo Excel e salvar em múltiplas planilhas
-        writer = pd.ExcelWriter(filename, engine='openpyxl')
-        for i in range(0, num_rows, max_rows_per_sheet):
-            # Divida os dados em partes de 'max_rows_per_sheet'
-            chunk = data.iloc[i:i + max_rows_per_sheet]
-            # Limpa caracteres ilegais no chunk
-            chunk = chunk.applymap(clean_illegal_characters)
-            # Salve cada parte em uma nova planilha
-            sheet_name = f'Sheet_{i // max_rows_per_sheet + 1}'
-            try:
-                chunk.to_excel(writer, sheet_name=sheet_name, index=False)
-                print(f"Exportando {len(chunk)} registros para {sheet_name}")
-            except IllegalCharacterError as e:
-                print(f"Erro ao salvar o chunk {sheet_name} devido a caracteres ilegais: {e}")
-        
-        writer.close()  # Corrigido para 'close'
-        print(f"Exportação para Excel em múltiplas planilhas concluída! Arquivo salvo como {filename}")
-
-def save_to_csv(data, filename='dados_classificados.csv'):
-    """
-    Salva o DataFrame processado em um arquivo CSV (.csv).
-    """
-    data.to_csv(filename, index=False)
-    print(f"Exportação para CSV concluída com sucesso! Arquivo salvo como {filename}")
+class StreamingExcelWriter:
+    """
+    Escreve um arquivo Excel (.xlsx) de forma incremental, bloco a bloco, usando o modo write-only do openpyxl
+    (as linhas vão para disco à medida que são escritas). Abre uma nova planilha a cada 'max_rows_per_sheet' linhas.
+    """
+
+    def __init__(self, filename, max_rows_per_sheet=1000000):
+        self.filename = filename
+        self.max_rows_per_sheet = max_rows_per_sheet
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.sheet_rows = 0
+        self.total_rows = 0
+
+    def _new_sheet(self, columns):
+        self.sheet = self.workbook.create_sheet(title=f'Sheet_{len(self.workbook.worksheets) + 1}')
+        self.sheet.append(list(columns))
+        self.sheet_rows = 0
+
+    def append(self, data):
+        # Limpa os textos coluna a coluna e troca nulos (NaN/NaT) por células vazias antes de escrever
+        data = clean_string_columns(format_derived_columns(data))
+        values = data.astype(object).where(data.notna(), None)
+        start = 0
+        while start < len(values):
+            if self.sheet is None or self.sheet_rows >= self.max_rows_per_sheet:
+                self._new_sheet(data.columns)
+            stop = start + self.max_rows_per_sheet - self.sheet_rows
+            for row in values.iloc[start:stop].itertuples(index=False, name=None):
+                self.sheet.append(row)
+            self.sheet_rows += len(values.iloc[start:stop])
+            start = stop
+        self.total_rows += len(data)
+
+    def close(self):
+        if self.sheet is None:
+            self.workbook.create_sheet(title='Sheet_1')
+        self.workbook.save(self.filename)
+        print(f"Exportação para Excel concluída! {self.total_rows} registros salvos em {self.filename}")
+
+def save_to_csv(data, filename='dados_classificados.csv', compression=None):
+    """
+    Salva o DataFrame processado em um arquivo CSV (.csv), opcionalmente comprimido (ver StreamingCsvWriter).
+    """
+    csv_writer = StreamingCsvWriter(filename, compression=compression)
+    csv_writer.append(data)
+    csv_writer.close()
+
+# Compressões aceitas pelo StreamingCsvWriter e a extensão de cada uma
+CSV_COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+def format_derived_columns(data):
+    """
+    Converte as colunas derivadas por process_data para os tipos gravados no Excel e nos formatos colunares,
+    uma vez por valor distinto: "Data Apenas" em date, "Hora Apenas" em time e as demais durações (timedelta64,
+    ex.: ActivityTime) em texto HH:MM:SS. Retorna uma cópia rasa do DataFrame.
+    """
+    data = data.copy(deep=False)
+    for column in data.columns:
+        values = data[column]
+        if column == DATE_ONLY_COLUMN and pd.api.types.is_datetime64_dtype(values):
+            data[column] = map_distinct(values, lambda value: value.date())
+        elif column == TIME_OF_DAY_COLUMN and pd.api.types.is_timedelta64_dtype(values):
+            data[column] = map_distinct(values, lambda value: (pd.Timestamp(0) + value).time())
+        elif pd.api.types.is_timedelta64_dtype(values):
+            data[column] = map_distinct(values, format_timedelta)
+    return data
+
+def format_csv_columns(data):
+    """
+    Converte em texto, uma vez por valor distinto, as colunas de data, hora e duração ("Data Apenas", "Hora Apenas",
+    ActivityTime), que o to_csv formataria elemento a elemento (ou, nas durações, como "0 days 00:01:40").
+    O texto é o mesmo que o to_csv produziria para os date/time do Python, e HH:MM:SS para as durações.
+    Retorna uma cópia rasa do DataFrame.
+    """
+    data = data.copy(deep=False)
+    for column in data.columns:
+        values = data[column]
+        if column == DATE_ONLY_COLUMN and pd.api.types.is_datetime64_dtype(values):
+            data[column] = map_distinct(values, lambda value: value.strftime('%Y-%m-%d'))
+        elif pd.api.types.is_timedelta64_dtype(values):
+            data[column] = map_distinct(values, format_timedelta)
+        elif values.dtype == object:
+            first = values.first_valid_index()
+            if first is not None and isinstance(values[first], (date, dt_time)):
+                data[column] = map_distinct(values, str)
+    return data
+
+class StreamingCsvWriter:
+    """
+    Escreve um arquivo CSV bloco a bloco: o primeiro bloco cria o arquivo com cabeçalho, os demais são anexados.
+    Com 'append', os blocos são anexados a um arquivo já existente (sem repetir o cabeçalho).
+    Cada bloco recebido é dividido em partes de 'block_size' linhas, convertidas em texto (to_csv) na thread
+    que chama append. Sem compressão, cada parte é gravada direto, sem threads: to_csv segura o GIL e não ganharia
+    nada com elas. Com 'compression' ('gzip' ou 'zstd', ou deduzida da extensão .gz/.zst do arquivo), cada parte
+    vira um membro gzip (zlib) ou um frame zstd (pyarrow) independente, comprimido por 'workers' threads (a
+    compressão libera o GIL) enquanto as partes seguintes são formatadas, e gravado na ordem original.
+    Arquivos com vários membros/frames concatenados são lidos normalmente por gzip/zstd e pelo pandas (.zst
+    requer o pacote zstandard), inclusive depois de anexar.
+    """
+
+    def __init__(self, filename, append=False, compression=None, workers=None, block_size=50000):
+        if compression is None:
+            compression = next((name for name, suffix in CSV_COMPRESSIONS.items() if filename.endswith(suffix)), None)
+        if compression is not None and compression not in CSV_COMPRESSIONS:
+            raise ValueError(f"Compressão de CSV desconhecida: {compression} (use {', '.join(CSV_COMPRESSIONS)}).")
+        self.filename = filename
+        self.compression = compression
+        self.block_size = block_size
+        self.total_rows = 0
+        self.has_header = append and os.path.exists(filename)
+        self.file = open(filename, 'ab' if self.has_header else 'wb')
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers) if compression else None
+
+    def _compress(self, encoded):
+        # Roda nas threads: zlib e a compressão do pyarrow liberam o GIL
+        if self.compression == 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+            return compressor.compress(encoded) + compressor.flush()
+        return pa.compress(encoded, codec='zstd', asbytes=True)
+
+    def append(self, data):
+        if data.empty and self.has_header:
+            return
+        data = format_csv_columns(data)
+        pending = deque()
+        for start in range(0, max(len(data), 1), self.block_size):
+            block = data.iloc[start:start + self.block_size]
+            encoded = block.to_csv(index=False, header=not self.has_header).encode('utf-8')
+            self.has_header = True
+            if self.executor is None:
+                self.file.write(encoded)
+                continue
+            # Até 'workers' partes sendo comprimidas enquanto a próxima é formatada
+            pending.append(self.executor.submit(self._compress, encoded))
+            if len(pending) > self.workers:
+                self.file.write(pending.popleft().result())
+        while pending:
+            self.file.write(pending.popleft().result())
+        self.total_rows += len(data)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.file.close()
+        print(f"Exportação para CSV concluída com sucesso! {self.total_rows} registros salvos em {self.filename}")
+
+# Colunas de baixa cardinalidade gravadas como dicionário (categorical) nos formatos colunares
+DICTIONARY_COLUMNS = ['Classificação', 'SubClassificação', 'Tipo', 'ProcessName', 'Domain', 'UserName', 'HostName']
+
+# Coluna (YYYY-MM-DD) usada para particionar o dataset Parquet por data
+PARTITION_COLUMN = 'Dia'
+
+def to_arrow_table(data, schema=None):
+    """
+    Converte o DataFrame em tabela Arrow, com as colunas de DICTIONARY_COLUMNS dictionary-encoded.
+    Sem 'schema', fixa os tipos (dicionários com índice int32, colunas só com nulos como texto) para que
+    os próximos blocos possam ser convertidos com o mesmo schema na escrita incremental.
+    As colunas derivadas por process_data mantêm os tipos de antes (date32, time64 e texto HH:MM:SS).
+    """
+    data = format_derived_columns(data)
+    for column in data.columns:
+        values = data[column]
+        # Colunas de texto com valores de outros tipos misturados são gravadas como texto
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True).startswith('mixed'):
+            values = values.where(values.isna(), values.astype(str))
+        if column in DICTIONARY_COLUMNS and not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+        data[column] = values
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    if schema is None:
+        fields = []
+        for field in table.schema:
+            if pa.types.is_dictionary(field.type):
+                field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+            elif pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            fields.append(field)
+        schema = pa.schema(fields, metadata=table.schema.metadata)
+    return table.cast(schema)
+
+def add_partition_column(data):
+    """
+    Adiciona a coluna de partição (data da atividade no formato YYYY-MM-DD) derivada de 'Date'.
+    """
+    return data.assign(**{PARTITION_COLUMN: pd.to_datetime(data['Date']).dt.strftime('%Y-%m-%d')})
+
+class StreamingParquetWriter:
+    """
+    Escreve o resultado em Parquet de forma incremental, um row group por bloco (limitado a 'row_group_size').
+    Com 'partition_by_date', grava um dataset particionado por dia (diretórios Dia=YYYY-MM-DD); nesse caso,
+    cada dia recebido substitui os arquivos antigos do mesmo dia, a menos que 'append' seja True.
+    """
+
+    def __init__(self, path, row_group_size=100000, partition_by_date=False, append=False):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.partition_by_date = partition_by_date
+        self.append_to_existing = append
+        self.run_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        self.writer = None
+        self.schema = None
+        self.parts = 0
+        self.seen_partitions = set()
+        self.total_rows = 0
+
+    def append(self, data):
+        if data.empty:
+            return
+        if self.partition_by_date:
+            data = add_partition_column(data)
+        table = to_arrow_table(data, self.schema)
+        self.schema = table.schema
+        if self.partition_by_date:
+            self._write_partitions(data[PARTITION_COLUMN], table)
+        else:
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.total_rows += len(data)
+
+    def _write_partitions(self, days, table):
+        # Dias vistos pela primeira vez nesta execução substituem os arquivos existentes; os demais são anexados
+        new_days = ~days.isin(self.seen_partitions).to_numpy()
+        self.seen_partitions.update(days.unique())
+        for mask, behavior in ((new_days, 'delete_matching'), (~new_days, 'overwrite_or_ignore')):
+            if not mask.any():
+                continue
+            if self.append_to_existing:
+                behavior = 'overwrite_or_ignore'
+            pq.write_to_dataset(table.filter(pa.array(mask)), root_path=self.path, partition_cols=[PARTITION_COLUMN],
+                                basename_template=f"parte-{self.run_id}-{self.parts}-{{i}}.parquet",
+                                existing_data_behavior=behavior, row_group_size=self.row_group_size)
+            self.parts += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        print(f"Exportação para Parquet concluída! {self.total_rows} registros salvos em {self.path}")
+
+class StreamingArrowWriter:
+    """
+    Escreve o resultado em Arrow IPC (formato stream), um lote por bloco. O arquivo pode ser lido de volta
+    sem cópia com read_arrow_results (memory map).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sink = None
+        self.writer = None
+        self.schema = None
+        self.total_rows = 0
+
+    def append(self, data):
+        if data.empty:
+            return
+        table = to_arrow_table(data, self.schema)
+        if self.writer is None:
+            self.schema = table.schema
+            self.sink = pa.OSFile(self.filename, 'wb')
+            self.writer = pa.ipc.new_stream(self.sink, self.schema)
+        self.writer.write_table(table)
+        self.total_rows += len(data)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.sink.close()
+        print(f"Exportação para Arrow concluída! {self.total_rows} registros salvos em {self.filename}")
+
+def save_to_parquet(data, path='dados_classificados.parquet', row_group_size=100000, partition_by_date=False):
+    """
+    Salva o DataFrame processado em Parquet, com as colunas categóricas dictionary-encoded.
+    Com 'partition_by_date', 'path' é um diretório de dataset particionado por dia.
+    """
+    parquet_writer = StreamingParquetWriter(path, row_group_size=row_group_size, partition_by_date=partition_by_date)
+    parquet_writer.append(data)
+    parquet_writer.close()
+
+def save_to_arrow(data, filename='dados_classificados.arrows'):
+    """
+    Salva o DataFrame processado em Arrow IPC, com as colunas categóricas dictionary-encoded.
+    """
+    arrow_writer = StreamingArrowWriter(filename)
+    arrow_writer.append(data)
+    arrow_writer.close()
+
+def read_arrow_results(filename):
+    """
+    Lê um arquivo gerado por save_to_arrow/StreamingArrowWriter via memory map (sem copiar os dados para a memória).
+    Retorna uma tabela Arrow; use .to_pandas() para obter um DataFrame.
+    """
+    return pa.ipc.open_stream(pa.memory_map(filename, 'r')).read_all()
+
+EXPORT_FORMATS = ('excel', 'csv', 'parquet', 'arrow')
+
+# Formatos que aceitam anexar à saída existente (modo incremental), e os padrões de cada modo
+APPEND_FORMATS = ('csv', 'parquet')
+DEFAULT_EXPORT_FORMATS = 'excel,csv'
+DEFAULT_INCREMENTAL_FORMATS = ','.join(APPEND_FORMATS)
+
+def parse_export_formats(formats):
+    """
+    Converte a lista de formatos (string separada por vírgula) em lista validada de EXPORT_FORMATS.
+    """
+    formats = [export_format.strip().lower() for export_format in formats.split(",") if export_format.strip()]
+    unknown = [export_format for export_format in formats if export_format not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"Formato(s) de exportação desconhecido(s): {', '.join(unknown)}")
+    return formats
+
+def check_append_formats(formats):
+    """
+    Levanta ValueError se algum formato não suportar a exportação incremental (ver APPEND_FORMATS).
+    """
+    unsupported = [export_format for export_format in formats if export_format not in APPEND_FORMATS]
+    if unsupported:
+        raise ValueError(f"Formato(s) sem suporte a exportação incremental: {', '.join(unsupported)}")
+
+def create_export_writers(basename, formats, partition_by_date=False, append=False, csv_compression=None):
+    """
+    Cria os writers incrementais para os formatos pedidos (ver EXPORT_FORMATS), todos com o mesmo nome base.
+    Com 'append' (modo incremental), anexa à saída existente: só CSV e Parquet (sempre particionado por dia) suportam isso.
+    Com 'csv_compression' ('gzip' ou 'zstd'), o CSV é gravado comprimido (.csv.gz ou .csv.zst).
+    """
+    csv_filename = f"{basename}.csv{CSV_COMPRESSIONS.get(csv_compression, '')}"
+    if append:
+        check_append_formats(formats)
+        partition_by_date = True
+    factories = {
+        'excel': lambda: StreamingExcelWriter(f"{basename}.xlsx"),
+        'csv': lambda: StreamingCsvWriter(csv_filename, append=append, compression=csv_compression,
+                                          workers=int(os.getenv('CSV_WORKERS') or 0) or None),
+        'parquet': lambda: StreamingParquetWriter(basename if partition_by_date else f"{basename}.parquet",
+                                                  partition_by_date=partition_by_date, append=append),
+        'arrow': lambda: StreamingArrowWriter(f"{basename}.arrows"),
+    }
+    return [factories[export_format]() for export_format in formats]
 
 load_dotenv()
 
-def build_query(start_date=None, end_date=None):
+def parse_usernames(usernames):
+    """
+    Converte a entrada de usernames (string separada por vírgula ou lista) em uma lista de nomes em minúsculas.
+    Retorna lista vazia quando nenhum username é informado.
+    """
+    if isinstance(usernames, str):
+        usernames = usernames.split(",")
+    return [user.strip().lower() for user in (usernames or []) if isinstance(user, str) and user.strip()]
+
+def build_user_filter(usernames):
+    """
+    Monta o predicado SQL (parametrizado) sobre utWin_UserNameDic.UserName para os usernames informados,
+    com a mesma regra de filter_by_user: compara só a parte após a última barra invertida, sem espaços e em minúsculas.
+    Retorna (predicado, parâmetros) ou (None, {}) se não houver usernames.
+    """
+    usernames = parse_usernames(usernames)
+    if not usernames:
+        return None, {}
+    params = {f"username_{i}": user for i, user in enumerate(usernames)}
+    placeholders = ", ".join(f":{name}" for name in params)
+    canonical_user = ("LOWER(LTRIM(RTRIM(CASE WHEN CHARINDEX(CHAR(92), p.UserName) > 0 "
+                      "THEN RIGHT(p.UserName, CHARINDEX(CHAR(92), REVERSE(p.UserName)) - 1) "
+                      "ELSE p.UserName END)))")
+    # O UserName final é DomainName + '\' + UserName: com DomainName nulo ele vira NULL e nunca casa no filtro
+    return f"p.DomainName IS NOT NULL AND {canonical_user} IN ({placeholders})", params
+
+def _where(conditions):
+    """
+    Junta as condições em uma cláusula WHERE (ou string vazia se não houver condições).
+    """
+    conditions = [condition for condition in conditions if condition]
+    return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+def build_query(start_date=None, end_date=None, usernames=None, high_water_marks=None, aggregate=False, slice_range=None,
+                date_expression=UDF_DATE_EXPRESSION):
     """
     Constrói a consulta SQL com base no intervalo de datas fornecido pelo usuário.
     Se datas não forem fornecidas, todos os dados serão retornados.
+    Se usernames forem informados, o filtro é aplicado no próprio SQL Server (em todas as CTEs de atividade),
+    evitando trafegar linhas de outros usuários. Retorna um TextClause do SQLAlchemy com os parâmetros já vinculados.
+    Com 'high_water_marks' ({tabela de origem: último UTCActualSliceId processado}, ver incremental.py), cada tabela
+    só retorna slices posteriores à sua marca, e o resultado ganha as colunas PartitionID e SourceTable.
+    Com 'aggregate', o SQL Server devolve só SUM(ActivityTime) e a contagem de registros por usuário, dia e
+    combinação (ProcessName, Domain, URL_Name, WindowTitle), em vez das linhas de detalhe (ver summarize_activity).
+    O filtro de datas vira faixas de PartitionID por ano (ver partition_planner.py), inclusive na virada do ano.
+    Como a PartitionID se repete a cada ano, o resultado também é limitado ao ano certo: pela própria coluna Date
+    (calculada uma vez por linha, em CROSS APPLY) e, se informado, por 'slice_range' (UTCActualSliceId inicial e
+    final, ver slice_bounds), que já descarta os outros anos na leitura das partições.
+    'date_expression' é a expressão SQL da coluna Date (por padrão, a UDF escalar em cada linha; ver slice_dates.py);
+    com None, a consulta de detalhe não traz Date e ela é calculada no cliente a partir de UTCActualSliceId
+    (nesse caso, um intervalo de datas exige 'slice_range').
     """
-    # Converter as datas para o dia do ano (PartitionID)
-    start_partition = get_day_of_year(start_date) if start_date else None
-    end_partition = get_day_of_year(end_date) if end_date else None
+    if aggregate and date_expression is None:
+        raise ValueError("O modo agregado precisa de uma expressão SQL para Date (ver DateMapping.query_options).")
+    if start_date and end_date and date_expression is None and slice_range is None:
+        raise ValueError("Sem a coluna Date na consulta, o intervalo de datas precisa de slice_range para separar os anos.")
+
+    # Converter o intervalo de datas nas faixas de PartitionID (dia do ano) de cada ano coberto
+    segments = plan_partitions(start_date, end_date) if start_date and end_date else []
+
+    # Filtros de cada ramo das CTEs de atividade
+    partition_filter = partition_predicate(segments, 'u.[PartitionID]')
+    user_filter, params = build_user_filter(usernames)
+    range_filter = None
+    if slice_range is not None:
+        params['slice_from'], params['slice_to'] = int(slice_range[0]), int(slice_range[1])
+        range_filter = "u.[UTCActualSliceId] BETWEEN :slice_from AND :slice_to"
+
+    # Limite exato do intervalo pela coluna Date: descarta no SQL Server os outros anos com as mesmas PartitionID
+    date_source = ""
+    date_filter = ""
+    if segments and date_expression is not None:
+        params['date_from'] = segments[0]['start_date']
+        params['date_to'] = segments[-1]['end_date'] + timedelta(days=1)
+        date_source = f"""
+    CROSS APPLY (SELECT {date_expression} AS [Date]) AS dt"""
+        date_filter = """
+    WHERE dt.[Date] >= :date_from AND dt.[Date] < :date_to"""
+        date_expression = "dt.[Date]"
+
+    def activity_where(source_table):
+        # Filtros de data e usuário, mais a marca d'água da tabela no modo incremental
+        slice_filter = None
+        if high_water_marks and high_water_marks.get(source_table) is not None:
+            params[f"hwm_{source_table}"] = int(high_water_marks[source_table])
+            slice_filter = f"u.[UTCActualSliceId] > :hwm_{source_table}"
+        return _where([partition_filter, range_filter, user_filter, slice_filter])
+
+    tracking_columns = ""
+    if high_water_marks is not None:
+        tracking_columns = """,
+        data.[PartitionID],
+        data.[SourceTable]"""
 
     # Iniciar a query base
     query = """
@@ -169,14 +781,14 @@ def build_query(start_date=None, end_date=None):
             u.[IsConnect],
             u.[PartitionID],
             p.UserName,
-            p.DomainName
+            p.DomainName,
+            'utWinClient_UserWebActivity' AS [SourceTable]
         FROM utWinClient_UserWebActivity u
         LEFT JOIN [dbo].[utWin_UserNameDic] p ON u.UserId = p.DictionaryId
     """
 
-    # Adicionar filtros de PartitionID se as datas forem fornecidas
-    if start_partition and end_partition:
-        query += f" WHERE u.[PartitionID] >= {start_partition} AND u.[PartitionID] <= {end_partition}"
+    # Adicionar filtros de PartitionID e de usuário, se fornecidos
+    query += activity_where('utWinClient_UserWebActivity')
 
     # Continuar a consulta com UNION
     query += """
@@ -195,14 +807,14 @@ def build_query(start_date=None, end_date=None):
             u.[IsConnect],
             u.[PartitionID],
             p.UserName,
-            p.DomainName
+            p.DomainName,
+            'utWinClient_UserAppActivity' AS [SourceTable]
         FROM utWinClient_UserAppActivity u
         LEFT JOIN [dbo].[utWin_UserNameDic] p ON u.UserId = p.DictionaryId
     """
 
-    # Adicionar novamente filtros de PartitionID se as datas forem fornecidas
-    if start_partition and end_partition:
-        query += f" WHERE u.[PartitionID] >= {start_partition} AND u.[PartitionID] <= {end_partition}"
+    # Adicionar novamente os filtros de PartitionID e de usuário
+    query += activity_where('utWinClient_UserAppActivity')
 
     # Fechar a query com a parte final da seleção e junções
     query += """
@@ -221,10 +833,16 @@ def build_query(start_date=None, end_date=None):
             u.[IsConnect],
             u.[PartitionID],
             p.UserName,
-            p.DomainName
+            p.DomainName,
+            'utWinServer_UserWebActivity' AS [SourceTable]
         FROM utWinServer_UserWebActivity u
         LEFT JOIN [dbo].[utWin_UserNameDic] p ON u.UserId = p.DictionaryId
+    """
 
+    # Os mesmos filtros nas atividades de servidor
+    query += activity_where('utWinServer_UserWebActivity')
+
+    query += """
         UNION ALL
 
         SELECT  
@@ -240,26 +858,73 @@ def build_query(start_date=None, end_date=None):
             u.[IsConnect],
             u.[PartitionID],
             p.UserName,
-            p.DomainName
+            p.DomainName,
+            'utWinServer_UserAppActivity' AS [SourceTable]
         FROM utWinServer_UserAppActivity u
         LEFT JOIN [dbo].[utWin_UserNameDic] p ON u.UserId = p.DictionaryId
+    """
+
+    query += activity_where('utWinServer_UserAppActivity')
+
+    # Fechar a query com a seleção final e junções
+    query += """
     )
+"""
+    if aggregate:
+        # Modo agregado: um registro por usuário, dia e combinação de entradas da classificação
+        query += """
+    SELECT
+        [UserName],
+        [Date],
+        [ProcessId],
+        [ProcessName],
+        [Domain],
+        [URL_Name],
+        [WindowTitle],
+        SUM(CAST([ActivityTime] AS bigint)) AS [ActivityTime],
+        COUNT_BIG(*) AS [Registros]
+    FROM (
+        SELECT
+            (CASE WHEN LEN(p.UserName) = 0 THEN SPACE(0) ELSE p.[DomainName] + CHAR(92) + p.UserName END) AS [UserName],
+            CAST(""" + date_expression + """ AS date) AS [Date],
+            data.[ProcessId],
+            pd.[ProcessName],
+            [Domain],
+            [URL] AS [URL_Name],
+            [WindowTitle],
+            [ActivityTime]
+        FROM (
+            SELECT * FROM CTE_UserWebAppActivity
+            UNION ALL
+            SELECT * FROM CTE_ServerWebAppActivity
+        ) AS data
+        JOIN CTE_ComputerDetails cd ON data.ComputerId = cd.Id
+        JOIN CTE_ProcessDetails pd ON data.ProcessId = pd.DictionaryId
+        LEFT JOIN [dbo].[utWin_UserNameDic] p ON p.DictionaryId = data.UserId""" + date_source.replace("\n    ", "\n        ") + \
+        date_filter.replace("\n    ", "\n        ") + """
+    ) AS detail
+    GROUP BY [UserName], [Date], [ProcessId], [ProcessName], [Domain], [URL_Name], [WindowTitle];
+    """
+        return text(query).bindparams(**params)
 
+    date_column = f"""
+        ({date_expression}) AS [Date],""" if date_expression is not None else ""
+    query += """
     SELECT
         data.ComputerId,
         cd.[Host] AS OrganizationId,
         COALESCE(cd.ClientMachineName, cd.ServerMachineName) AS [MachineName],
         COALESCE(cd.ClientTcpAddress, cd.ServerTcpAddress) AS [IpAddress],
         cd.[Host] AS HostName,
-        (CASE WHEN LEN(p.UserName) = 0 THEN SPACE(0) ELSE p.[DomainName] + CHAR(92) + p.UserName END) AS [UserName],
-        ([dbo].[uf_GetDateByUTCSliceId]([UTCActualSliceId], 1, 0)) AS [Date],
+        (CASE WHEN LEN(p.UserName) = 0 THEN SPACE(0) ELSE p.[DomainName] + CHAR(92) + p.UserName END) AS [UserName],""" + date_column + """
+        data.[ProcessId],
         pd.[ProcessName],
         [Domain],
         [URL] AS [URL_Name],
         [WindowTitle],
         [UTCActualSliceId],
         [ActivityTime],
-        [IsConnect]
+        [IsConnect]""" + tracking_columns + """
     FROM (
         SELECT * FROM CTE_UserWebAppActivity
         UNION ALL
@@ -267,10 +932,29 @@ def build_query(start_date=None, end_date=None):
     ) AS data
     JOIN CTE_ComputerDetails cd ON data.ComputerId = cd.Id
     JOIN CTE_ProcessDetails pd ON data.ProcessId = pd.DictionaryId
-    LEFT JOIN [dbo].[utWin_UserNameDic] p ON p.DictionaryId = data.UserId;
+    LEFT JOIN [dbo].[utWin_UserNameDic] p ON p.DictionaryId = data.UserId""" + date_source + date_filter + """;
     """
-    return query
+    return text(query).bindparams(**params)
+
 
+def canonical_username(name):
+    """
+    Parte do UserName após a última barra invertida ('DOMINIO\\usuario' -> 'usuario'), sem espaços e em minúsculas.
+    Retorna None para valores nulos ou que não sejam texto.
+    """
+    if not isinstance(name, str):
+        return None
+    return name.rsplit("\\", 1)[-1].strip().lower()
+
+def with_result_cache(result_cache, query_args, usernames, fetch):
+    """
+    Blocos de fetch() (a consulta ao banco) passando pelo cache local de resultados, se houver um (ver query_cache.py).
+    'query_args' são os argumentos de build_query sem os usuários: essa consulta é a chave do cache.
+    """
+    if result_cache is None:
+        return fetch()
+    return result_cache.fetch_chunks(build_query(**query_args), parse_usernames(usernames), query_args.get('end_date'),
+                                     fetch, to_arrow_table)
 
 def filter_by_user(data, usernames):
     """
@@ -280,13 +964,14 @@ def filter_by_user(data, usernames):
     """
 
     # Limpar e separar os usernames por vírgula, se múltiplos forem fornecidos
-    if isinstance(usernames, str) and usernames.strip():  # Verifica se a string não está vazia
-        usernames = [user.strip().lower() for user in usernames.split(",")]
-    else:
-        usernames = []  # Se estiver vazio ou apenas espaços, definir como lista vazia
+    usernames = parse_usernames(usernames)
 
-    # Separar o 'UserName' no DataFrame após a barra invertida (caso exista) e converter para minúsculas
-    data['UserName'] = data['UserName'].apply(lambda x: x.split("\\")[-1].strip().lower() if isinstance(x, str) and "\\" in x else (x.strip().lower() if isinstance(x, str) else None))
+    # Separar o 'UserName' no DataFrame após a barra invertida (caso exista) e converter para minúsculas,
+    # uma vez por nome distinto
+    canonical_users = map_distinct(data['UserName'], canonical_username)
+    if isinstance(data['UserName'].dtype, pd.CategoricalDtype):
+        canonical_users = canonical_users.astype('category')
+    data['UserName'] = canonical_users
 
     # Filtrar pelo nome de usuário na lista
     if usernames:
@@ -297,6 +982,209 @@ def filter_by_user(data, usernames):
     return filtered_data
 
 
+def _append_to_writer(writer, data):
+    with stage(type(writer).__name__, rows_in=len(data)):
+        writer.append(data)
+
+def _close_writer(writer):
+    with stage(f"{type(writer).__name__}.close"):
+        writer.close()
+
+def run_streaming_export(chunks, usernames, writers, cache=None, workers=None, state=None, queue_size=0):
+    """
+    Exporta os dados em modo streaming: cada bloco lido do banco (execute_query_in_chunks ou
+    extract_partitions_parallel) passa por filtro -> classificação -> escrita em todos os 'writers'
+    e é descartado em seguida, de modo que o pico de memória depende do tamanho do bloco e não do intervalo de datas.
+    Com um IncrementalState, as marcas d'água são atualizadas a cada bloco e gravadas após fechar os writers.
+    Com 'queue_size' > 0, as etapas se sobrepõem (ver pipeline.py): a leitura do banco roda em uma thread à frente
+    da classificação, e cada writer em sua própria thread, todos ligados por filas de até 'queue_size' blocos.
+    A classificação continua na thread principal, dona da conexão do ClassificationStore.
+    """
+    pipeline = None
+    if queue_size:
+        pipeline = Pipeline(queue_size)
+        chunks = pipeline.source(chunks, name='fetch')
+        for writer in writers:
+            pipeline.sink(partial(_append_to_writer, writer), close=partial(_close_writer, writer),
+                          name=type(writer).__name__)
+
+    total_rows = 0
+    try:
+        for chunk in chunks:
+            if state is not None:
+                state.observe(chunk)
+                chunk = chunk.drop(columns=TRACKING_COLUMNS)
+            with stage('filter_by_user', rows_in=len(chunk)) as record:
+                filtered_chunk = filter_by_user(chunk, usernames)
+                record['rows_out'] = len(filtered_chunk)
+            with stage('process_data', rows_in=len(filtered_chunk)) as record:
+                processed_chunk = process_data(filtered_chunk, cache=cache, workers=workers)
+                record['rows_out'] = len(processed_chunk)
+            if pipeline is not None:
+                pipeline.send(processed_chunk)
+            else:
+                for writer in writers:
+                    _append_to_writer(writer, processed_chunk)
+            total_rows += len(processed_chunk)
+            print(f"{total_rows} registros processados...")
+        if pipeline is not None:
+            pipeline.finish()
+    except BaseException:
+        if pipeline is not None:
+            pipeline.cancel()
+        raise
+
+    if pipeline is None:
+        for writer in writers:
+            _close_writer(writer)
+    if state is not None:
+        state.save()
+    return total_rows
+
+
+def load_jobs(path, default_formats=DEFAULT_EXPORT_FORMATS):
+    """
+    Lê o arquivo de lote (JSON com uma lista de exportações). Cada exportação tem 'output' (nome base dos arquivos)
+    e, opcionalmente, 'users' (string separada por vírgula ou lista), 'start_date'/'end_date' (YYYY-MM-DD) e 'formats'.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        specs = json.load(file)
+    if isinstance(specs, dict):
+        specs = specs.get('jobs', [])
+    jobs = []
+    for position, spec in enumerate(specs):
+        if not spec.get('output'):
+            raise ValueError(f"Exportação {position} de {path} sem 'output'.")
+        for key in ('start_date', 'end_date'):
+            if spec.get(key):
+                datetime.strptime(spec[key], "%Y-%m-%d")  # Valida o formato (levanta ValueError)
+        formats = spec.get('formats', default_formats)
+        jobs.append({
+            'output': spec['output'],
+            'users': parse_usernames(spec.get('users')),
+            'start_date': spec.get('start_date') or None,
+            'end_date': spec.get('end_date') or None,
+            'formats': parse_export_formats(formats if isinstance(formats, str) else ','.join(formats)),
+        })
+    return jobs
+
+def _job_range(job):
+    # Sem as duas datas, build_query não filtra por partição: a exportação cobre todo o período
+    if job['start_date'] and job['end_date']:
+        return job['start_date'], job['end_date']
+    return None, None
+
+def group_overlapping_jobs(jobs):
+    """
+    Agrupa as exportações cujos intervalos de datas se sobrepõem, para que cada grupo seja extraído com uma única consulta.
+    Exportações sem intervalo cobrem todo o período e, portanto, se sobrepõem a todas as outras.
+    """
+    unbounded = [job for job in jobs if _job_range(job) == (None, None)]
+    if unbounded:
+        return [jobs]
+    groups = []
+    for job in sorted(jobs, key=lambda job: _job_range(job)[0]):
+        start, end = _job_range(job)
+        if groups and start <= groups[-1]['end_date']:
+            groups[-1]['jobs'].append(job)
+            groups[-1]['end_date'] = max(groups[-1]['end_date'], end)
+        else:
+            groups.append({'start_date': start, 'end_date': end, 'jobs': [job]})
+    return [group['jobs'] for group in groups]
+
+def job_mask(data, job):
+    """
+    Seleciona, no resultado da extração de um grupo, as linhas que a consulta da própria exportação retornaria:
+    mesmos usuários, mesmas partições e o mesmo limite exato de Date que build_query aplica
+    (start <= Date < end + 1 dia), o que também separa os anos que compartilham as mesmas PartitionID.
+    """
+    mask = pd.Series(True, index=data.index)
+    if job['users']:
+        mask &= data['UserName'].isin(job['users'])
+    start, end = _job_range(job)
+    if start:
+        mask &= data['PartitionID'].isin(partition_ids(plan_partitions(start, end)))
+        mask &= (data['Date'] >= pd.Timestamp(start)) & (data['Date'] < pd.Timestamp(end) + pd.Timedelta(days=1))
+    return mask
+
+def run_batch_export(engine, jobs, chunksize=100000, cache=None, workers=None, date_mapping=None, csv_compression=None,
+                     result_cache=None):
+    """
+    Executa um lote de exportações com uma única engine: as exportações com intervalos sobrepostos são extraídas
+    juntas (uma consulta com a união dos usuários e o intervalo total), filtradas e classificadas uma vez
+    e distribuídas bloco a bloco para os writers de cada exportação.
+    """
+    date_mapping = date_mapping or DateMapping()
+    for group in group_overlapping_jobs(jobs):
+        starts = [_job_range(job)[0] for job in group]
+        ends = [_job_range(job)[1] for job in group]
+        start_date = None if None in starts else min(starts)
+        end_date = None if None in ends else max(ends)
+        # Se alguma exportação pede todos os usuários, o grupo não filtra por usuário
+        usernames = [] if any(not job['users'] for job in group) else sorted({user for job in group for user in job['users']})
+        print(f"Extraindo {start_date or 'início'} a {end_date or 'fim'} para {len(group)} exportação(ões)")
+
+        # high_water_marks vazio: sem filtro de slices, mas com PartitionID no resultado para separar as exportações
+        query_args = dict(start_date=start_date, end_date=end_date, high_water_marks={},
+                          **date_mapping.query_options(start_date, end_date))
+        query = build_query(usernames=usernames, **query_args)
+        writers = [create_export_writers(job['output'], job['formats'], csv_compression=csv_compression) for job in group]
+        chunks = with_result_cache(result_cache, query_args, usernames,
+                                   lambda: execute_query_in_chunks(engine, query, chunksize=chunksize))
+        for chunk in date_mapping.attach_chunks(chunks):
+            with stage('filter_by_user', rows_in=len(chunk)) as record:
+                filtered_chunk = filter_by_user(chunk, usernames)
+                record['rows_out'] = len(filtered_chunk)
+            with stage('process_data', rows_in=len(filtered_chunk)) as record:
+                processed_chunk = process_data(filtered_chunk, cache=cache, workers=workers)
+                record['rows_out'] = len(processed_chunk)
+            for job, job_writers in zip(group, writers):
+                job_chunk = processed_chunk[job_mask(processed_chunk, job)].drop(columns=TRACKING_COLUMNS)
+                for writer in job_writers:
+                    with stage(type(writer).__name__, rows_in=len(job_chunk)):
+                        writer.append(job_chunk)
+        for job_writers in writers:
+            for writer in job_writers:
+                with stage(f"{type(writer).__name__}.close"):
+                    writer.close()
+
+def parse_date_argument(value):
+    """
+    Valida uma data (YYYY-MM-DD) recebida pela linha de comando.
+    """
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data inválida: {value} (use YYYY-MM-DD)")
+    return value
+
+def parse_arguments(argv=None):
+    """
+    Lê os argumentos da linha de comando. Sem nenhum argumento, main.py continua perguntando usuários e datas via input.
+    Os valores padrão vêm das variáveis de ambiente (.env) equivalentes.
+    """
+    parser = argparse.ArgumentParser(description="Extrai, classifica e exporta as atividades dos usuários.")
+    parser.add_argument('--users', help="Usuário(s) separados por vírgula (vazio = todos).")
+    parser.add_argument('--start-date', type=parse_date_argument, help="Data inicial (YYYY-MM-DD).")
+    parser.add_argument('--end-date', type=parse_date_argument, help="Data final (YYYY-MM-DD).")
+    parser.add_argument('--output', default='resultado_dados_classificados', help="Nome base dos arquivos de saída.")
+    parser.add_argument('--formats', default=os.getenv('EXPORT_FORMATS'),
+                        help=f"Formatos separados por vírgula ({', '.join(EXPORT_FORMATS)}); padrão {DEFAULT_EXPORT_FORMATS}, "
+                             f"ou {DEFAULT_INCREMENTAL_FORMATS} no modo incremental.")
+    parser.add_argument('--jobs', help="Arquivo JSON com um lote de exportações (ver load_jobs).")
+    parser.add_argument('--aggregate', action='store_true',
+                        help="Exporta só o tempo total por usuário, dia e classificação (agregado no SQL Server).")
+    parser.add_argument('--chunksize', type=int, default=int(os.getenv('EXPORT_CHUNKSIZE') or 0) or None,
+                        help="Exporta em modo streaming, em blocos desse tamanho.")
+    parser.add_argument('--csv-compression', choices=list(CSV_COMPRESSIONS), default=os.getenv('CSV_COMPRESSION') or None,
+                        help="Grava o CSV comprimido (.csv.gz ou .csv.zst).")
+    parser.add_argument('--pipeline', type=int, default=int(os.getenv('PIPELINE_QUEUE_SIZE') or 0), metavar='QUEUE_SIZE',
+                        help="Sobrepõe leitura, classificação e writers (modo streaming) com filas desse tamanho.")
+    parser.add_argument('--date-mapping', choices=DATE_MAPPINGS, default=os.getenv('DATE_MAPPING', 'udf'),
+                        help="Como obter a coluna Date a partir de UTCActualSliceId (ver slice_dates.py).")
+    parser.add_argument('--trace', default=os.getenv('INSTRUMENTATION_TRACE_PATH'),
+                        help="Grava o trace de instrumentação (JSON) neste arquivo.")
+    return parser.parse_args(argv)
 
 def get_date_input(prompt):
     """
@@ -315,10 +1203,14 @@ def get_date_input(prompt):
             print("Data inválida! Por favor, insira no formato YYYY-MM-DD.")
 
 if __name__ == "__main__":
-    # Solicitar nome(s) do(s) usuário(s) e intervalo de datas via input
-    usernames = input("Digite o(s) nome(s) do(s) usuário(s) (separados por vírgula, ou deixe vazio para todos): ")
-    start_date = get_date_input("Digite a data inicial (YYYY-MM-DD, ou deixe vazio para todas): ")
-    end_date = get_date_input("Digite a data final (YYYY-MM-DD, ou deixe vazio para todas): ")
+    args = parse_arguments()
+    if len(sys.argv) == 1:
+        # Sem argumentos: solicitar nome(s) do(s) usuário(s) e intervalo de datas via input
+        usernames = input("Digite o(s) nome(s) do(s) usuário(s) (separados por vírgula, ou deixe vazio para todos): ")
+        start_date = get_date_input("Digite a data inicial (YYYY-MM-DD, ou deixe vazio para todas): ")
+        end_date = get_date_input("Digite a data final (YYYY-MM-DD, ou deixe vazio para todas): ")
+    else:
+        usernames, start_date, end_date = args.users or "", args.start_date, args.end_date
 
     # Configurações de conexão para SQL Server
     load_dotenv()
@@ -327,20 +1219,148 @@ if __name__ == "__main__":
     db_user = os.getenv('DB_USER')
     db_password = os.getenv('DB_PASSWORD')
 
-    # Obter engine de conexão
-    engine = get_database_engine(db_host, db_name, db_user, db_password)
+    # Dicionário persistente de classificações (ProcessId + hash do texto), invalidado por grupo de regras alterado
+    # e limitado a CLASSIFICATION_STORE_MAX_ENTRIES entradas (as usadas há mais tempo são descartadas)
+    classification_cache = ClassificationStore(os.getenv('CLASSIFICATION_STORE_PATH', 'dicionario_classificacao.db'),
+                                               max_entries=int(os.getenv('CLASSIFICATION_STORE_MAX_ENTRIES') or 500000))
+    # O cache em pickle das versões anteriores foi substituído pelo dicionário (o arquivo antigo não é apagado)
+    legacy_cache_path = os.getenv('CLASSIFICATION_CACHE_PATH', 'cache_classificacao.pkl')
+    if os.path.exists(legacy_cache_path):
+        print(f"Aviso: {legacy_cache_path} não é mais usado (substituído por {classification_cache.path}) e pode ser removido.")
+    classification_workers = int(os.getenv('CLASSIFICATION_WORKERS') or 1)
+
+    # Formatos de saída (--formats ou EXPORT_FORMATS=excel,csv,parquet,arrow); PARQUET_PARTITION_BY_DATE=1 grava um dataset por dia
+    export_formats = parse_export_formats(args.formats or DEFAULT_EXPORT_FORMATS)
+    partition_by_date = os.getenv('PARQUET_PARTITION_BY_DATE', '').lower() in ('1', 'true', 'sim')
+
+    # Com QUERY_CACHE_DIR definido, guarda os resultados das consultas em disco (ver query_cache.py):
+    # intervalos já fechados voltam do cache sem consultar o banco, os demais valem por QUERY_CACHE_TTL segundos
+    result_cache = None
+    if os.getenv('QUERY_CACHE_DIR'):
+        result_cache = QueryResultCache(os.getenv('QUERY_CACHE_DIR'), ttl_seconds=int(os.getenv('QUERY_CACHE_TTL') or 3600),
+                                        max_bytes=int(os.getenv('QUERY_CACHE_MAX_MB') or 2048) * 2 ** 20)
+
+    # Com INCREMENTAL_STATE_PATH definido, extrai só os slices posteriores à última execução e anexa à saída existente
+    incremental_state = None
+    if os.getenv('INCREMENTAL_STATE_PATH') and not (args.jobs or args.aggregate):
+        # Só formatos que aceitam anexar; conferidos antes de qualquer acesso ao banco
+        export_formats = parse_export_formats(args.formats or DEFAULT_INCREMENTAL_FORMATS)
+        check_append_formats(export_formats)
+        incremental_state = IncrementalState(os.getenv('INCREMENTAL_STATE_PATH'), parse_usernames(usernames),
+                                             output=output_key(args.output, export_formats, args.csv_compression))
+        if incremental_state.start_date():
+            start_date, end_date = incremental_state.start_date(), datetime.now().strftime("%Y-%m-%d")
+            print(f"Extração incremental a partir de {start_date}")
+
+    # Com EXTRACTION_WORKERS definido (e intervalo de datas informado), extrai fatias diárias em paralelo
+    extraction_workers = int(os.getenv('EXTRACTION_WORKERS') or 0)
+    parallel_extraction = (extraction_workers > 0 and bool(start_date and end_date) and incremental_state is None
+                           and not (args.jobs or args.aggregate))
+
+    # Obter engine de conexão (com um pool dimensionado para os workers da extração paralela)
+    with stage('connect'):
+        # DB_POOL_SIZE sobrepõe o tamanho do pool; com extração paralela, uma conexão aquecida por worker
+        pool_size = int(os.getenv('DB_POOL_SIZE') or 0) or (extraction_workers if parallel_extraction else 5)
+        engine = get_database_engine(db_host, db_name, db_user, db_password, pool_size=pool_size,
+                                     packet_size=int(os.getenv('DB_PACKET_SIZE') or 0) or None,
+                                     warm_up=extraction_workers if parallel_extraction else 1)
+
+    # Coluna Date: UDF por linha (padrão), calculada no cliente a partir dos slices ou buscada em tabela pré-calculada
+    with stage('date_mapping'):
+        date_mapping = load_date_mapping(engine, args.date_mapping, start_date, end_date)
+
+    if args.jobs:
+        # Modo lote: todas as exportações do arquivo usam a mesma engine; intervalos sobrepostos são extraídos juntos
+        run_batch_export(engine, load_jobs(args.jobs, args.formats or DEFAULT_EXPORT_FORMATS), chunksize=args.chunksize or 100000,
+                         cache=classification_cache, workers=classification_workers, date_mapping=date_mapping,
+                         csv_compression=args.csv_compression, result_cache=result_cache)
+    elif args.aggregate:
+        # Modo agregado: o SQL Server soma ActivityTime por usuário, dia e combinação de entradas; só o resumo é gravado
+        query_args = dict(start_date=start_date, end_date=end_date, aggregate=True,
+                          **date_mapping.query_options(start_date, end_date, aggregate=True))
+        query = build_query(usernames=usernames, **query_args)
+        with stage('execute_query_with_retry') as record:
+            data = concat_typed_chunks(list(with_result_cache(result_cache, query_args, usernames,
+                                                              lambda: [execute_query_with_retry(engine, query)])))
+            record['rows_out'] = len(data)
+        with stage('filter_by_user', rows_in=len(data)) as record:
+            filtered_data = filter_by_user(data, usernames)
+            record['rows_out'] = len(filtered_data)
+        with stage('summarize_activity', rows_in=len(filtered_data)) as record:
+            summary_data = summarize_activity(filtered_data, cache=classification_cache, workers=classification_workers)
+            record['rows_out'] = len(summary_data)
+        writers = create_export_writers(args.output, export_formats, partition_by_date=partition_by_date,
+                                        csv_compression=args.csv_compression)
+        for writer in writers:
+            with stage(type(writer).__name__, rows_in=len(summary_data)):
+                writer.append(summary_data)
+                writer.close()
+    elif parallel_extraction or args.chunksize or incremental_state or args.pipeline:
+        # Modo streaming (memória limitada ao tamanho do bloco): --chunksize/EXPORT_CHUNKSIZE, extração paralela,
+        # incremental ou --pipeline/PIPELINE_QUEUE_SIZE
+        if parallel_extraction:
+            # As threads medem consulta e transferência de cada fatia; aqui mede-se a espera do pipeline pelas fatias
+            chunks = measure_chunks(extract_partitions_parallel(engine, start_date, end_date, usernames, max_workers=extraction_workers,
+                                                                date_mapping=date_mapping, result_cache=result_cache),
+                                    first_stage='wait_first_partition', stage='wait_partition')
+        else:
+            # Construir a consulta com base no intervalo de datas; o filtro de usuário já é aplicado no SQL Server
+            # (no modo incremental, as marcas d'água mudam a cada execução: o resultado não vai para o cache)
+            high_water_marks = incremental_state.high_water_marks() if incremental_state else None
+            query_args = dict(start_date=start_date, end_date=end_date, high_water_marks=high_water_marks,
+                              **date_mapping.query_options(start_date, end_date))
+            query = build_query(usernames=usernames, **query_args)
+            chunks = with_result_cache(None if incremental_state else result_cache, query_args, usernames,
+                                       lambda: execute_query_in_chunks(engine, query, chunksize=args.chunksize or 100000))
+            chunks = date_mapping.attach_chunks(chunks)
+        writers = create_export_writers(args.output, export_formats,
+                                        partition_by_date=partition_by_date, append=incremental_state is not None,
+                                        csv_compression=args.csv_compression)
+        run_streaming_export(chunks, usernames, writers, cache=classification_cache, workers=classification_workers,
+                             state=incremental_state, queue_size=args.pipeline)
+    else:
+        # Construir a consulta com base no intervalo de datas; o filtro de usuário já é aplicado no SQL Server
+        query_args = dict(start_date=start_date, end_date=end_date, **date_mapping.query_options(start_date, end_date))
+        query = build_query(usernames=usernames, **query_args)
+        with stage('execute_query_with_retry') as record:
+            data = concat_typed_chunks(list(with_result_cache(result_cache, query_args, usernames,
+                                                              lambda: [execute_query_with_retry(engine, query)])))
+            data = date_mapping.attach(data)
+            record['rows_out'] = len(data)
 
-    # Construir e executar a consulta com base no intervalo de datas
-    query = build_query(start_date, end_date)
-    data = execute_query_with_retry(engine, query)
+        # Normalizar o UserName (e refiltrar) no Python após a consulta SQL
+        with stage('filter_by_user', rows_in=len(data)) as record:
+            filtered_data = filter_by_user(data, usernames)
+            record['rows_out'] = len(filtered_data)
 
-    # Aplicar o filtro de username(s) no Python após a consulta SQL
-    filtered_data = filter_by_user(data, usernames)
+        # Processar os dados, reaproveitando as classificações de execuções anteriores
+        with stage('process_data', rows_in=len(filtered_data)) as record:
+            processed_data = process_data(filtered_data, cache=classification_cache, workers=classification_workers)
+            record['rows_out'] = len(processed_data)
 
-    # Processar os dados
-    processed_data = process_data(filtered_data)
+        # Salvar os dados nos formatos pedidos (por padrão, Excel e CSV)
+        if 'excel' in export_formats:
+            with stage('save_to_excel', rows_in=len(processed_data)):
+                save_to_excel(processed_data, filename=f"{args.output}.xlsx")
+        if 'csv' in export_formats:
+            with stage('save_to_csv', rows_in=len(processed_data)):
+                save_to_csv(processed_data, filename=f"{args.output}.csv{CSV_COMPRESSIONS.get(args.csv_compression, '')}",
+                            compression=args.csv_compression)
+        if 'parquet' in export_formats:
+            with stage('save_to_parquet', rows_in=len(processed_data)):
+                save_to_parquet(processed_data, args.output if partition_by_date else f"{args.output}.parquet",
+                                partition_by_date=partition_by_date)
+        if 'arrow' in export_formats:
+            with stage('save_to_arrow', rows_in=len(processed_data)):
+                save_to_arrow(processed_data, filename=f"{args.output}.arrows")
 
-    # Salvar os dados em arquivos Excel e CSV
-    save_to_excel(processed_data, filename='resultado_dados_classificados.xlsx')
-    save_to_csv(processed_data, filename='resultado_dados_classificados.csv')
+    classification_cache.report()
+    classification_cache.save()
+    if result_cache is not None:
+        result_cache.report()
 
+    # Resumo de tempo, CPU, linhas e memória por etapa; --trace/INSTRUMENTATION_TRACE_PATH grava também o trace em JSON
+    pipeline_metrics.report()
+    connection_metrics.report()
+    if args.trace:
+        pipeline_metrics.write_trace(args.trace)
@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+
+
+# As tabelas de atividade são particionadas pelo dia do ano (PartitionID = 1..366), sem o ano
+MAX_PARTITION = 366
+
+
+def to_date(value):
+    """
+    Aceita date/datetime ou string YYYY-MM-DD e retorna um date.
+    """
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if hasattr(value, 'date'):
+        return value.date()
+    return value
+
+
+def plan_partitions(start_date, end_date):
+    """
+    Divide o intervalo de datas (inclusivo) em segmentos de um mesmo ano, cada um com sua faixa contínua de PartitionID.
+    Ex.: 2025-12-20 a 2026-01-10 -> [(2025, 354..365), (2026, 1..10)].
+    """
+    start, end = to_date(start_date), to_date(end_date)
+    if start > end:
+        raise ValueError(f"Data inicial {start} posterior à data final {end}.")
+    segments = []
+    for year in range(start.year, end.year + 1):
+        segment_start = max(start, date(year, 1, 1))
+        segment_end = min(end, date(year, 12, 31))
+        segments.append({
+            'year': year,
+            'start_date': segment_start,
+            'end_date': segment_end,
+            'first_partition': segment_start.timetuple().tm_yday,
+            'last_partition': segment_end.timetuple().tm_yday,
+        })
+    return segments
+
+
+def partition_ranges(segments):
+    """
+    Une as faixas de PartitionID dos segmentos (anos diferentes compartilham os mesmos números de partição)
+    em faixas disjuntas e ordenadas.
+    """
+    ranges = []
+    for first, last in sorted((segment['first_partition'], segment['last_partition']) for segment in segments):
+        if ranges and first <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], last)
+        else:
+            ranges.append([first, last])
+    return [tuple(partition_range) for partition_range in ranges]
+
+
+def partition_predicate(segments, column='u.[PartitionID]'):
+    """
+    Predicado SQL (sargável: só BETWEEN com constantes, unidos por OR) que seleciona as partições dos segmentos.
+    Retorna None quando todas as partições são necessárias (intervalos de um ano ou mais).
+    """
+    ranges = partition_ranges(segments)
+    if not ranges or ranges == [(1, MAX_PARTITION)]:
+        return None
+    predicates = [f"{column} BETWEEN {first} AND {last}" for first, last in ranges]
+    return predicates[0] if len(predicates) == 1 else "(" + " OR ".join(predicates) + ")"
+
+
+def partition_ids(segments):
+    """
+    Conjunto de PartitionID dos segmentos, para filtrar no pandas o que o predicado filtra no SQL Server.
+    """
+    return {partition for first, last in partition_ranges(segments) for partition in range(first, last + 1)}
+
+
+def slice_bounds(start_date, end_date, date_to_slice):
+    """
+    Limites de UTCActualSliceId (do início do primeiro dia ao fim do último) para restringir o intervalo ao ano certo,
+    já que a PartitionID se repete a cada ano. 'date_to_slice' converte um date no primeiro slice do dia.
+    """
+    start, end = to_date(start_date), to_date(end_date)
+    return date_to_slice(start), date_to_slice(end + timedelta(days=1)) - 1
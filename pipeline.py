@@ -0,0 +1,138 @@
+import queue
+import threading
+
+
+# Marca de fim de fluxo nas filas
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Executa etapas do export em threads ligadas por filas limitadas a 'queue_size' blocos: a leitura do banco
+    (source) roda à frente da classificação, e cada writer (sink) grava em paralelo com os demais a partir do mesmo
+    bloco classificado. Filas cheias bloqueiam quem produz (backpressure), de modo que no máximo
+    'queue_size' blocos ficam esperando em cada fila. Um erro em qualquer thread interrompe todas as etapas
+    e é relançado na thread principal.
+    Os blocos entregues aos sinks são compartilhados entre eles e não podem ser alterados.
+    """
+
+    def __init__(self, queue_size=2, poll_interval=0.1):
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.stop = threading.Event()
+        self.errors = []
+        self.threads = []
+        self.sinks = []
+
+    def _start(self, name, target):
+        def run():
+            try:
+                target()
+            except BaseException as e:
+                self.errors.append(e)
+                self.stop.set()
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _raise_error(self):
+        if self.errors:
+            raise self.errors[0]
+
+    def _put(self, items, item):
+        # Espera por espaço na fila, desistindo se o pipeline for interrompido
+        while not self.stop.is_set():
+            try:
+                items.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, items):
+        while True:
+            try:
+                return items.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return _DONE
+
+    def source(self, iterable, name='source'):
+        """
+        Consome 'iterable' (ex.: os blocos lidos do banco) em uma thread, à frente de quem itera o gerador retornado.
+        """
+        items = queue.Queue(self.queue_size)
+
+        def produce():
+            iterator = iter(iterable)
+            try:
+                for item in iterator:
+                    if not self._put(items, item):
+                        return
+                self._put(items, _DONE)
+            finally:
+                # Encerra geradores interrompidos no meio (ex.: cancela as fatias pendentes da extração paralela)
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+
+        self._start(name, produce)
+
+        def consume():
+            while True:
+                item = self._get(items)
+                if item is _DONE:
+                    self._raise_error()
+                    return
+                yield item
+
+        return consume()
+
+    def sink(self, consumer, close=None, name='sink'):
+        """
+        Cria uma thread que chama consumer(item) para cada item enviado por send() e close() no fim do fluxo.
+        """
+        items = queue.Queue(self.queue_size)
+
+        def run():
+            while True:
+                item = self._get(items)
+                if item is _DONE:
+                    break
+                consumer(item)
+            if close is not None and not self.stop.is_set():
+                close()
+
+        self._start(name, run)
+        self.sinks.append(items)
+
+    def send(self, item):
+        """
+        Entrega o item a todos os sinks, esperando enquanto alguma fila estiver cheia.
+        """
+        for items in self.sinks:
+            if not self._put(items, item):
+                self._raise_error()
+                raise RuntimeError("Pipeline interrompido.")
+
+    def finish(self):
+        """
+        Sinaliza o fim do fluxo aos sinks, espera todas as threads terminarem e relança o primeiro erro.
+        """
+        for items in self.sinks:
+            self._put(items, _DONE)
+        self.join()
+
+    def cancel(self):
+        """
+        Interrompe todas as etapas (ex.: erro na thread principal) e espera as threads terminarem,
+        sem relançar os erros delas.
+        """
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        self._raise_error()
@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import glob
+import time
+import hashlib
+import threading
+import pyarrow as pa
+from datetime import date
+from partition_planner import to_date
+
+
+class QueryResultCache:
+    """
+    Cache local (em disco, Arrow IPC comprimido com zstd) dos resultados de build_query, para que execuções
+    repetidas sobre o mesmo intervalo não voltem ao banco de produção.
+    A chave é o texto SQL normalizado (espaços colapsados) e os parâmetros da consulta *sem* o filtro de usuários,
+    que já define as partições e os slices lidos. Os usuários ficam nos metadados da entrada: um resultado gravado
+    para todos os usuários, ou para um conjunto que contém os pedidos, também serve, já que filter_by_user refiltra
+    as linhas no Python de qualquer forma.
+    Entradas cujo intervalo termina antes de hoje (partições fechadas) são imutáveis e não expiram; as demais
+    valem por 'ttl_seconds'. Acima de 'max_bytes', as entradas usadas há mais tempo são descartadas.
+    """
+
+    def __init__(self, directory, ttl_seconds=3600, max_bytes=2 * 2 ** 30):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(query):
+        """
+        Hash do texto SQL normalizado e dos parâmetros vinculados de um TextClause.
+        """
+        sql = re.sub(r'\s+', ' ', str(query)).strip()
+        params = query.compile().params
+        payload = json.dumps({'sql': sql, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entries(self, key):
+        for metadata_path in glob.glob(os.path.join(self.directory, f"{key}-*.json")):
+            try:
+                with open(metadata_path, 'r', encoding='utf-8') as file:
+                    metadata = json.load(file)
+            except (OSError, ValueError):
+                continue
+            yield metadata_path, metadata
+
+    def _is_expired(self, metadata):
+        return not metadata['immutable'] and time.time() - metadata['created_at'] > self.ttl_seconds
+
+    def _remove(self, metadata_path):
+        for path in (metadata_path, metadata_path[:-len('.json')] + '.arrows'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # já removido, ou aberto por outra leitura (Windows): fica para o próximo descarte
+
+    def lookup(self, query, usernames=None):
+        """
+        Caminho do resultado em cache para a consulta (sem filtro de usuários) que cubra 'usernames', ou None.
+        """
+        usernames = set(usernames or [])
+        with self._lock:
+            for metadata_path, metadata in self._entries(self.key(query)):
+                if self._is_expired(metadata):
+                    self._remove(metadata_path)
+                    continue
+                cached_users = set(metadata['usernames'])
+                if cached_users and (not usernames or not usernames <= cached_users):
+                    continue
+                data_path = metadata_path[:-len('.json')] + '.arrows'
+                if os.path.exists(data_path):
+                    os.utime(data_path)  # marca como usada recentemente (ordem de descarte por tamanho)
+                    return data_path
+        return None
+
+    @staticmethod
+    def read_chunks(path):
+        """
+        Lê o resultado em cache bloco a bloco (um DataFrame por bloco gravado).
+        """
+        with pa.OSFile(path, 'rb') as source:
+            reader = pa.ipc.open_stream(source)
+            empty = True
+            for batch in reader:
+                empty = False
+                yield batch.to_pandas()
+            if empty:
+                # Resultado vazio: ainda assim um DataFrame com as colunas da consulta
+                yield reader.schema.empty_table().to_pandas()
+
+    def fetch_chunks(self, query, usernames, end_date, fetch, to_table):
+        """
+        Devolve os blocos do cache se houver uma entrada válida para 'query' (a consulta sem filtro de usuários)
+        que cubra 'usernames'. Senão, repassa os blocos de fetch() (a consulta de fato, ao banco) e os grava no
+        cache ao final; se a leitura for interrompida, nada é gravado. 'to_table' converte cada bloco em uma
+        tabela Arrow com o schema do primeiro (ver to_arrow_table).
+        """
+        path = self.lookup(query, usernames)
+        if path is not None:
+            self.hits += 1
+            print(f"Resultado da consulta lido do cache local ({path})")
+            yield from self.read_chunks(path)
+            return
+        self.misses += 1
+
+        key = self.key(query)
+        users = sorted(usernames or [])
+        base_path = os.path.join(self.directory, f"{key}-{hashlib.sha256(','.join(users).encode('utf-8')).hexdigest()[:16]}")
+        temp_path = f"{base_path}.{threading.get_ident()}.tmp"
+        writer = None
+        schema = None
+        rows = 0
+        try:
+            for chunk in fetch():
+                table = to_table(chunk, schema)
+                if writer is None:
+                    schema = table.schema
+                    writer = pa.ipc.new_stream(temp_path, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+                writer.write_table(table)
+                rows += len(chunk)
+                yield chunk
+            if writer is None:
+                return
+            writer.close()
+            writer = None
+            with self._lock:
+                os.replace(temp_path, f"{base_path}.arrows")
+                with open(f"{base_path}.json", 'w', encoding='utf-8') as file:
+                    json.dump({'usernames': users, 'end_date': str(end_date) if end_date else None, 'rows': rows,
+                               'created_at': time.time(), 'immutable': self.is_closed(end_date)}, file)
+                self._evict()
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def is_closed(end_date):
+        """
+        Intervalos que terminam antes de hoje só cobrem partições fechadas: o resultado não muda mais.
+        Sem data final (todo o período), a consulta inclui o dia corrente.
+        """
+        return end_date is not None and to_date(end_date) < date.today()
+
+    def _evict(self):
+        # Descarta as entradas usadas há mais tempo até caber em max_bytes
+        data_paths = sorted(glob.glob(os.path.join(self.directory, '*.arrows')), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in data_paths)
+        for data_path in data_paths:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(data_path)
+            self._remove(data_path[:-len('.arrows')] + '.json')
+
+    def report(self):
+        if self.hits or self.misses:
+            print(f"Cache de consultas: {self.hits} acertos, {self.misses} faltas ({self.directory})")
@@ -0,0 +1,286 @@
+"""
+Conversão de UTCActualSliceId em data/hora sem chamar a UDF escalar [dbo].[uf_GetDateByUTCSliceId] por linha.
+
+A UDF escalar impede paralelismo no plano do SQL Server e é executada uma vez por linha do resultado. Como os slices
+são intervalos de tempo de duração fixa numerados em sequência, a data de um slice é uma função linear do seu id:
+
+    Date = reference_time + (UTCActualSliceId - reference_slice) * slice_seconds
+
+SliceCalendar guarda esses três valores, calibrados com a própria UDF em alguns slices do intervalo consultado
+(ou lidos de SLICE_REFERENCE_ID, SLICE_REFERENCE_TIME e SLICE_SECONDS) e sempre conferidos com ela antes do uso:
+se a UDF não for linear (ex.: conversão de fuso com horário de verão), a conferência falha e é preciso usar
+outro modo. Modos de DateMapping (DATE_MAPPING):
+    - 'udf': a UDF em cada linha (comportamento original);
+    - 'client': a consulta não calcula Date; a conversão é vetorizada no pandas a partir de UTCActualSliceId
+      (no modo agregado, a mesma fórmula vai inline no SQL, como DATEADD);
+    - 'table': busca a data em uma tabela pré-calculada (SLICE_DATE_TABLE, colunas UTCActualSliceId e Date),
+      preenchida uma vez por slice distinto com populate_slice_date_table.
+
+Executado diretamente, confere o calendário com a UDF (e, com --populate-table, preenche a tabela):
+    python slice_dates.py --start-date 2025-01-01 --end-date 2025-01-31
+A aritmética do calendário (sem banco) é testada em test_slice_dates.py.
+"""
+import os
+import re
+import sys
+import math
+import argparse
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from incremental import SOURCE_TABLES
+from partition_planner import plan_partitions, partition_predicate, slice_bounds, to_date
+
+
+# Expressão original (e padrão) da coluna Date em build_query
+UDF_DATE_EXPRESSION = "[dbo].[uf_GetDateByUTCSliceId]([UTCActualSliceId], 1, 0)"
+
+DATE_MAPPINGS = ['udf', 'client', 'table']
+
+
+def _table_name(table):
+    # O nome da tabela entra no SQL sem parâmetro: só aceita identificadores (com schema e colchetes opcionais)
+    if not table or not re.fullmatch(r"[\w\[\]]+(\.[\w\[\]]+)?", table):
+        raise ValueError(f"Nome de tabela inválido para SLICE_DATE_TABLE: {table!r}")
+    return table
+
+
+def slice_table_expression(table):
+    """
+    Expressão de Date que busca o slice na tabela pré-calculada (o otimizador a resolve como um join).
+    """
+    return f"(SELECT sd.[Date] FROM {_table_name(table)} sd WHERE sd.[UTCActualSliceId] = data.[UTCActualSliceId])"
+
+
+class SliceCalendar:
+    """
+    Mapeamento linear UTCActualSliceId -> data/hora (ver o início do módulo).
+    """
+
+    def __init__(self, reference_slice, reference_time, slice_seconds):
+        if slice_seconds <= 0:
+            raise ValueError(f"Duração de slice inválida: {slice_seconds} segundos.")
+        self.reference_slice = int(reference_slice)
+        self.reference_time = pd.Timestamp(reference_time)
+        self.slice_seconds = int(slice_seconds)
+
+    def __repr__(self):
+        return (f"SliceCalendar(reference_slice={self.reference_slice}, "
+                f"reference_time='{self.reference_time.isoformat()}', slice_seconds={self.slice_seconds})")
+
+    @classmethod
+    def from_env(cls):
+        """
+        Calendário fixo de SLICE_REFERENCE_ID, SLICE_REFERENCE_TIME e SLICE_SECONDS, ou None se não estiverem definidos.
+        """
+        values = [os.getenv(name) for name in ('SLICE_REFERENCE_ID', 'SLICE_REFERENCE_TIME', 'SLICE_SECONDS')]
+        if not all(values):
+            return None
+        return cls(int(values[0]), values[1], int(values[2]))
+
+    @classmethod
+    def calibrate(cls, engine, slice_ids):
+        """
+        Ajusta o calendário com as datas que a UDF devolve para o menor e o maior dos 'slice_ids'.
+        """
+        low, high = int(min(slice_ids)), int(max(slice_ids))
+        if low == high:
+            raise ValueError("A calibração precisa de pelo menos dois slices diferentes.")
+        dates = udf_dates(engine, [low, high])
+        slice_seconds = round((dates[high] - dates[low]).total_seconds() / (high - low))
+        return cls(low, dates[low], slice_seconds)
+
+    def to_timestamps(self, slice_ids):
+        """
+        Converte uma Series de UTCActualSliceId em datetime64, de forma vetorizada.
+        """
+        offsets = (slice_ids.astype('int64') - self.reference_slice) * self.slice_seconds
+        return self.reference_time + pd.to_timedelta(offsets, unit='s')
+
+    def to_slice(self, value):
+        """
+        Primeiro slice que começa em 'value' (data ou data/hora) ou depois dele; usado por slice_bounds.
+        """
+        offset = (pd.Timestamp(value) - self.reference_time).total_seconds()
+        return self.reference_slice + math.ceil(offset / self.slice_seconds)
+
+    def sql_expression(self, column='[UTCActualSliceId]'):
+        """
+        A mesma fórmula em T-SQL (DATEADD só aceita int: o deslocamento é contado a partir do slice de referência).
+        """
+        return (f"DATEADD(SECOND, CAST(({column} - {self.reference_slice}) * {self.slice_seconds} AS int), "
+                f"CAST('{self.reference_time.isoformat(sep=' ')}' AS datetime2))")
+
+
+def udf_dates(engine, slice_ids):
+    """
+    Datas calculadas pela UDF para os 'slice_ids', em uma única consulta. Retorna uma Series indexada pelo slice.
+    """
+    params = {f"slice_{i}": int(slice_id) for i, slice_id in enumerate(slice_ids)}
+    values = ", ".join(f"(:{name})" for name in params)
+    query = text(f"""
+        SELECT v.id AS [UTCActualSliceId], [dbo].[uf_GetDateByUTCSliceId](v.id, 1, 0) AS [Date]
+        FROM (VALUES {values}) AS v(id)
+    """).bindparams(**params)
+    with engine.connect() as connection:
+        result = pd.read_sql(query, connection)
+    return pd.Series(pd.to_datetime(result['Date']).to_numpy(), index=result['UTCActualSliceId'].astype('int64'))
+
+
+def sample_slice_ids(engine, start_date=None, end_date=None, samples=32):
+    """
+    Slices para calibrar e conferir o calendário: o menor e o maior slice das partições do intervalo
+    (utWinClient_UserAppActivity) e 'samples' ids igualmente espaçados entre eles.
+    """
+    partition_filter = partition_predicate(plan_partitions(start_date, end_date)) if start_date and end_date else None
+    where = f" WHERE {partition_filter}" if partition_filter else ""
+    query = text(f"SELECT MIN(u.[UTCActualSliceId]) AS low, MAX(u.[UTCActualSliceId]) AS high "
+                 f"FROM utWinClient_UserAppActivity u{where}")
+    with engine.connect() as connection:
+        low, high = connection.execute(query).one()
+    if low is None:
+        raise ValueError("Nenhum slice encontrado no intervalo para conferir o calendário.")
+    return sorted({int(slice_id) for slice_id in np.linspace(low, high, samples + 2).round()})
+
+
+def check_slice_calendar(engine, calendar, slice_ids):
+    """
+    Compara o calendário com a UDF nos 'slice_ids'. Retorna um DataFrame com as divergências (vazio se todas batem).
+    """
+    expected = udf_dates(engine, slice_ids)
+    computed = calendar.to_timestamps(pd.Series(expected.index, index=expected.index))
+    comparison = pd.DataFrame({'udf': expected, 'calendar': computed})
+    return comparison[comparison['udf'] != comparison['calendar']]
+
+
+def load_slice_calendar(engine, start_date=None, end_date=None):
+    """
+    Calendário de SLICE_REFERENCE_* ou calibrado com a UDF, conferido com ela nos slices do intervalo.
+    Levanta ValueError se alguma data divergir.
+    """
+    slice_ids = sample_slice_ids(engine, start_date, end_date)
+    calendar = SliceCalendar.from_env() or SliceCalendar.calibrate(engine, slice_ids)
+    mismatches = check_slice_calendar(engine, calendar, slice_ids)
+    if not mismatches.empty:
+        raise ValueError(f"{calendar} diverge da uf_GetDateByUTCSliceId em {len(mismatches)} de {len(slice_ids)} slices "
+                         f"(ex.: {mismatches.index[0]}: {mismatches.iloc[0]['udf']} != {mismatches.iloc[0]['calendar']}); "
+                         f"use DATE_MAPPING=table ou udf.")
+    print(f"Datas calculadas a partir dos slices: {calendar}")
+    return calendar
+
+
+def populate_slice_date_table(engine, table, start_date=None, end_date=None):
+    """
+    Grava na tabela pré-calculada a data (pela UDF) de cada slice distinto do intervalo que ainda não está nela.
+    A UDF roda uma vez por slice distinto, e não por linha. Retorna o número de slices incluídos.
+    """
+    table = _table_name(table)
+    partition_filter = partition_predicate(plan_partitions(start_date, end_date)) if start_date and end_date else None
+    where = f" WHERE {partition_filter}" if partition_filter else ""
+    slices = "\n            UNION\n".join(f"            SELECT u.[UTCActualSliceId] FROM {source_table} u{where}"
+                                           for source_table in SOURCE_TABLES)
+    query = text(f"""
+        INSERT INTO {table} ([UTCActualSliceId], [Date])
+        SELECT s.[UTCActualSliceId], [dbo].[uf_GetDateByUTCSliceId](s.[UTCActualSliceId], 1, 0)
+        FROM (
+{slices}
+        ) AS s
+        WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.[UTCActualSliceId] = s.[UTCActualSliceId])
+    """)
+    with engine.begin() as connection:
+        return connection.execute(query).rowcount
+
+
+class DateMapping:
+    """
+    Como a coluna Date é obtida (ver o início do módulo): fornece as opções de build_query para cada consulta
+    e, no modo 'client', acrescenta Date aos blocos lidos do banco.
+    """
+
+    def __init__(self, mode='udf', calendar=None, table=None):
+        if mode not in DATE_MAPPINGS:
+            raise ValueError(f"DATE_MAPPING inválido: {mode} (use {', '.join(DATE_MAPPINGS)}).")
+        if mode == 'client' and calendar is None:
+            raise ValueError("DATE_MAPPING=client precisa de um SliceCalendar (ver load_slice_calendar).")
+        if mode == 'table':
+            _table_name(table)
+        self.mode = mode
+        self.calendar = calendar
+        self.table = table
+
+    def query_options(self, start_date=None, end_date=None, aggregate=False):
+        """
+        Argumentos date_expression e slice_range de build_query. Com o calendário, o intervalo também é
+        limitado por UTCActualSliceId, o que separa os anos que compartilham as mesmas PartitionID já na leitura.
+        Nos modos 'udf' e 'table' o calendário (de SLICE_REFERENCE_*) não foi conferido com a UDF: a faixa ganha
+        um dia de folga de cada lado e o limite exato fica com o filtro pela coluna Date de build_query.
+        """
+        options = {}
+        if self.mode == 'client':
+            # Sem Date na consulta de detalhe (calculada em attach); no agregado, a fórmula vai inline para o GROUP BY
+            options['date_expression'] = self.calendar.sql_expression() if aggregate else None
+        elif self.mode == 'table':
+            options['date_expression'] = slice_table_expression(self.table)
+        if self.calendar is not None and start_date and end_date:
+            start, end = to_date(start_date), to_date(end_date)
+            if self.mode != 'client':
+                start, end = start - timedelta(days=1), end + timedelta(days=1)
+            options['slice_range'] = slice_bounds(start, end, self.calendar.to_slice)
+        return options
+
+    def attach(self, data):
+        """
+        No modo 'client', insere a coluna Date (logo após UserName, onde a consulta a colocaria).
+        """
+        if self.mode != 'client' or 'Date' in data.columns:
+            return data
+        position = data.columns.get_loc('UserName') + 1 if 'UserName' in data.columns else len(data.columns)
+        data.insert(position, 'Date', self.calendar.to_timestamps(data['UTCActualSliceId']))
+        return data
+
+    def attach_chunks(self, chunks):
+        for chunk in chunks:
+            yield self.attach(chunk)
+
+
+def load_date_mapping(engine, mode='udf', start_date=None, end_date=None):
+    """
+    DateMapping do modo pedido: no 'client', calibra e confere o calendário nos slices do intervalo;
+    no 'table', usa a tabela de SLICE_DATE_TABLE. Nos modos 'udf' e 'table', um calendário de SLICE_REFERENCE_*
+    (se definido) só serve para pré-filtrar os slices do intervalo (ver DateMapping.query_options).
+    """
+    if mode == 'client':
+        return DateMapping('client', calendar=load_slice_calendar(engine, start_date, end_date))
+    if mode == 'table':
+        return DateMapping('table', calendar=SliceCalendar.from_env(), table=os.getenv('SLICE_DATE_TABLE'))
+    return DateMapping(mode, calendar=SliceCalendar.from_env())
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Confere o cálculo de datas a partir dos slices com a uf_GetDateByUTCSliceId.")
+    parser.add_argument('--start-date', help="Data inicial (YYYY-MM-DD) das partições usadas na conferência.")
+    parser.add_argument('--end-date', help="Data final (YYYY-MM-DD).")
+    parser.add_argument('--samples', type=int, default=32, help="Quantidade de slices conferidos.")
+    parser.add_argument('--populate-table', action='store_true',
+                        help="Preenche SLICE_DATE_TABLE com os slices do intervalo ainda ausentes.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from database_config import get_database_engine
+
+    args = parse_arguments()
+    load_dotenv()
+    engine = get_database_engine(os.getenv('DB_HOST'), os.getenv('DB_NAME'), os.getenv('DB_USER'), os.getenv('DB_PASSWORD'))
+    slice_ids = sample_slice_ids(engine, args.start_date, args.end_date, samples=args.samples)
+    calendar = SliceCalendar.from_env() or SliceCalendar.calibrate(engine, slice_ids)
+    mismatches = check_slice_calendar(engine, calendar, slice_ids)
+    print(f"{calendar}: {len(slice_ids) - len(mismatches)} de {len(slice_ids)} slices iguais à UDF")
+    if not mismatches.empty:
+        print(mismatches.to_string())
+    if args.populate_table:
+        inserted = populate_slice_date_table(engine, os.getenv('SLICE_DATE_TABLE'), args.start_date, args.end_date)
+        print(f"{inserted} slices incluídos em {os.getenv('SLICE_DATE_TABLE')}")
+    sys.exit(1 if not mismatches.empty else 0)
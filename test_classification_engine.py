@@ -0,0 +1,122 @@
+"""
+Testes de equivalência do classificador vetorizado (classification_engine.py, regras em classification_rules.json)
+com as funções por regra originais. Os resultados esperados foram obtidos com utilities.classify_activity da
+versão inicial do repositório (commit e2c06d3), inclusive nos casos em que a normalização antiga não casa
+um padrão (ex.: domínios com ponto, que normalize_text remove).
+
+    python -m unittest test_classification_engine
+"""
+import unittest
+
+import pandas as pd
+
+from classification_engine import classify_dataframe
+from utilities import classify_activity
+
+
+INPUT_COLUMNS = ['ProcessName', 'WindowTitle', 'Domain', 'URL_Name']
+RESULT_COLUMNS = ['Classificação', 'SubClassificação', 'Tipo']
+
+PESSOAL = 'Acesso Pessoal'
+SEBRAE = 'Acesso Sebrae'
+OUTROS = ('Outros', None, 'Outros')
+
+# (ProcessName, WindowTitle, Domain, URL_Name) -> (Classificação, SubClassificação, Tipo)
+GROUP_CASES = [
+    # whatsapp
+    (('chrome.exe', 'WhatsApp', '', ''), ('WhatsApp', 'WhatsApp', PESSOAL)),
+    (('chrome.exe', 'Home', 'web.whatsapp.com', ''), OUTROS),
+    # redes_sociais
+    (('chrome.exe', 'Facebook - Home', '', ''), ('Pessoais', 'Facebook', PESSOAL)),
+    (('chrome.exe', 'Pinterest', '', ''), ('Pessoais', 'Pinterest', PESSOAL)),
+    (('chrome.exe', 'Página inicial', 'www.instagram.com', ''), ('Pessoais', None, PESSOAL)),
+    (('chrome.exe', 'Página inicial', '', 'https://www.instagram.com/p/1'), ('Pessoais', None, PESSOAL)),
+    # streaming
+    (('chrome.exe', 'Netflix', '', ''), ('Aplicativo de Streaming', 'Netflix', PESSOAL)),
+    (('chrome.exe', 'Vídeo', 'www.youtube.com', ''), OUTROS),
+    # escritorio
+    (('WINWORD.EXE', 'Documento1', '', ''), ('Aplicativo de Escritório', 'Microsoft Word', SEBRAE)),
+    (('chrome.exe', 'Planilha', 'docs.google.com', ''), OUTROS),
+    # compras
+    (('chrome.exe', 'Amazon.com.br', '', ''), ('Pessoais', 'Amazon', PESSOAL)),
+    (('chrome.exe', 'Ofertas', 'www.mercadolivre.com.br', ''), OUTROS),
+    # desenvolvimento
+    (('Code.exe', 'main.py - Visual Studio Code', '', ''), ('Aplicativos de Desenvolvimento', 'VS Code', SEBRAE)),
+    (('chrome.exe', 'repo', 'github.com', ''), OUTROS),
+    # sebrae
+    (('chrome.exe', 'Cérebro - Início', '', ''), ('Acessos Sebrae', 'Cérebro', SEBRAE)),
+    (('chrome.exe', 'arquivo', '', 'https://intranet/doc.pdf'), ('Acessos Sebrae', None, SEBRAE)),
+    # pdf
+    (('foxitpdf.exe', 'documento', '', ''), ('PDF Viewer', 'PDF', SEBRAE)),
+    # skype
+    (('chrome.exe', 'Skype', '', ''), ('Comunication', 'Skype Activity', SEBRAE)),
+    (('skype.exe', 'chamada', '', ''), ('Comunication', 'Skype Activity', SEBRAE)),
+    # sem classificação
+    (('notepad.exe', 'Sem título', None, None), OUTROS),
+    ((None, None, None, None), OUTROS),
+]
+
+# Mais de um grupo casa: vence o de menor prioridade (a ordem das funções originais)
+PRIORITY_CASES = [
+    (('chrome.exe', 'WhatsApp no YouTube', '', ''), ('WhatsApp', 'WhatsApp', PESSOAL)),
+    (('chrome.exe', 'Netflix no Facebook', '', ''), ('Pessoais', 'Facebook', PESSOAL)),
+    (('chrome.exe', 'Facebook', 'www.youtube.com', ''), ('Pessoais', 'Facebook', PESSOAL)),
+    (('chrome.exe', 'Outlook - Caixa de entrada', '', ''), ('Aplicativo de Escritório', 'Microsoft Outlook', SEBRAE)),
+    (('chrome.exe', 'Teams e Skype', '', ''), ('Aplicativo de Escritório', 'Microsoft Teams', SEBRAE)),
+    (('chrome.exe', 'Docker', '', 'https://intranet/doc.pdf'), ('Aplicativos de Desenvolvimento', 'Docker', SEBRAE)),
+    (('chrome.exe', 'relatorio.pdf', '', ''), ('Acessos Sebrae', 'PDF', SEBRAE)),
+    (('chrome.exe', 'Cérebro RM', '', ''), ('Acessos Sebrae', 'Cérebro', SEBRAE)),
+]
+
+# Linhas com trigger false só escolhem a subcategoria: sozinhas não disparam o grupo
+TRIGGER_CASES = [
+    (('RM.exe', 'RM - Folha', '', ''), OUTROS),
+    (('chrome.exe', 'Relatório', '', 'https://intranet/cerebro/x'), OUTROS),
+    (('chrome.exe', 'Página inicial', 'm.facebook.com', ''), ('Pessoais', None, PESSOAL)),
+    (('chrome.exe', 'RM Folha', 'pdf', ''), ('Acessos Sebrae', 'RM', SEBRAE)),
+    (('chrome.exe', 'Folha RM', '', 'https://intranet/doc.pdf'), ('Acessos Sebrae', 'RM', SEBRAE)),
+]
+
+ALL_CASES = GROUP_CASES + PRIORITY_CASES + TRIGGER_CASES
+
+
+def _frame(cases):
+    return pd.DataFrame([inputs for inputs, _ in cases], columns=INPUT_COLUMNS)
+
+
+def _results(data):
+    return [tuple(None if pd.isna(value) else value for value in row)
+            for row in data[RESULT_COLUMNS].itertuples(index=False)]
+
+
+class ClassificationTest(unittest.TestCase):
+
+    def assertCases(self, cases, results):
+        for (inputs, expected), result in zip(cases, results):
+            with self.subTest(inputs=inputs):
+                self.assertEqual(result, expected)
+
+    def test_groups(self):
+        self.assertCases(GROUP_CASES, _results(classify_dataframe(_frame(GROUP_CASES))))
+
+    def test_priority_conflicts(self):
+        self.assertCases(PRIORITY_CASES, _results(classify_dataframe(_frame(PRIORITY_CASES))))
+
+    def test_trigger(self):
+        self.assertCases(TRIGGER_CASES, _results(classify_dataframe(_frame(TRIGGER_CASES))))
+
+    def test_classify_activity_row_by_row(self):
+        data = _frame(ALL_CASES).apply(classify_activity, axis=1)
+        self.assertCases(ALL_CASES, _results(data))
+
+    def test_memoize_matches_direct_classification(self):
+        # Repetições e a mesma combinação em posições diferentes exercitam a deduplicação de classify_distinct
+        data = pd.concat([_frame(ALL_CASES)] * 3, ignore_index=True).sample(frac=1, random_state=7)
+        memoized = classify_dataframe(data, memoize=True)
+        direct = classify_dataframe(data, memoize=False)
+        self.assertEqual(_results(memoized), _results(direct))
+        self.assertEqual(_results(memoized.sort_index().iloc[:len(ALL_CASES)]), [expected for _, expected in ALL_CASES])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Testes determinísticos da conversão UTCActualSliceId <-> data/hora de SliceCalendar (sem banco de dados).
+A conferência com a uf_GetDateByUTCSliceId de verdade continua em `python slice_dates.py` (ver o início de slice_dates.py).
+
+    python -m unittest test_slice_dates
+"""
+import unittest
+from datetime import date
+
+import pandas as pd
+
+from partition_planner import slice_bounds
+from slice_dates import SliceCalendar, DateMapping
+
+
+# Calendário de referência: slices de 5 minutos, o slice 1000 começa às 23:55 da véspera do ano novo (UTC)
+CALENDAR = SliceCalendar(1000, '2025-12-31 23:55:00', 300)
+
+# Pares slice -> data/hora conhecidos, na mesma escala
+KNOWN_SLICES = {
+    0: pd.Timestamp('2025-12-28 12:35:00'),
+    999: pd.Timestamp('2025-12-31 23:50:00'),
+    1000: pd.Timestamp('2025-12-31 23:55:00'),
+    1001: pd.Timestamp('2026-01-01 00:00:00'),  # virada do ano
+    1289: pd.Timestamp('2026-01-02 00:00:00'),
+    26069: pd.Timestamp('2026-03-29 01:00:00'),  # início do horário de verão europeu: em UTC, nada muda
+    26070: pd.Timestamp('2026-03-29 01:05:00'),
+}
+
+
+class SliceCalendarTest(unittest.TestCase):
+
+    def test_to_timestamps_matches_known_slices(self):
+        slice_ids = pd.Series(list(KNOWN_SLICES), dtype='int32')
+        computed = CALENDAR.to_timestamps(slice_ids)
+        self.assertEqual(list(computed), list(KNOWN_SLICES.values()))
+
+    def test_to_slice_is_inverse_of_to_timestamps(self):
+        for slice_id, timestamp in KNOWN_SLICES.items():
+            self.assertEqual(CALENDAR.to_slice(timestamp), slice_id)
+
+    def test_to_slice_rounds_up_inside_a_slice(self):
+        # Um instante no meio do slice 1000 pertence ao intervalo a partir do slice seguinte
+        self.assertEqual(CALENDAR.to_slice('2025-12-31 23:56:00'), 1001)
+        self.assertEqual(CALENDAR.to_slice(date(2026, 1, 1)), 1001)
+
+    def test_slice_bounds_across_year_boundary(self):
+        self.assertEqual(slice_bounds('2025-12-31', '2025-12-31', CALENDAR.to_slice), (713, 1000))
+        self.assertEqual(slice_bounds('2026-01-01', '2026-01-01', CALENDAR.to_slice), (1001, 1288))
+        self.assertEqual(slice_bounds('2025-12-31', '2026-01-01', CALENDAR.to_slice), (713, 1288))
+
+    def test_utc_slices_are_uniform_across_dst_change(self):
+        timestamps = CALENDAR.to_timestamps(pd.Series(range(26057, 26082)))
+        self.assertTrue((timestamps.diff().dropna() == pd.Timedelta(seconds=300)).all())
+
+    def test_sql_expression(self):
+        self.assertEqual(CALENDAR.sql_expression(),
+                         "DATEADD(SECOND, CAST(([UTCActualSliceId] - 1000) * 300 AS int), "
+                         "CAST('2025-12-31 23:55:00' AS datetime2))")
+        self.assertEqual(CALENDAR.sql_expression('u.[UTCActualSliceId]'),
+                         "DATEADD(SECOND, CAST((u.[UTCActualSliceId] - 1000) * 300 AS int), "
+                         "CAST('2025-12-31 23:55:00' AS datetime2))")
+
+    def test_invalid_slice_seconds(self):
+        with self.assertRaises(ValueError):
+            SliceCalendar(1000, '2025-12-31 23:55:00', 0)
+
+
+class DateMappingTest(unittest.TestCase):
+
+    def test_client_slice_range_is_exact(self):
+        options = DateMapping('client', calendar=CALENDAR).query_options('2026-01-01', '2026-01-01')
+        self.assertEqual(options, {'date_expression': None, 'slice_range': (1001, 1288)})
+
+    def test_udf_slice_range_has_one_day_of_slack(self):
+        options = DateMapping('udf', calendar=CALENDAR).query_options('2026-01-01', '2026-01-01')
+        self.assertEqual(options, {'slice_range': (713, 1576)})
+
+    def test_attach_inserts_date_after_username(self):
+        data = pd.DataFrame({'UserName': ['a', 'b'], 'UTCActualSliceId': [1000, 1001]})
+        attached = DateMapping('client', calendar=CALENDAR).attach(data)
+        self.assertEqual(list(attached.columns), ['UserName', 'Date', 'UTCActualSliceId'])
+        self.assertEqual(list(attached['Date']), [KNOWN_SLICES[1000], KNOWN_SLICES[1001]])
+
+
+if __name__ == '__main__':
+    unittest.main()